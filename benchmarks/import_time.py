@@ -0,0 +1,92 @@
+"""
+起動時の import にかかる時間を python -X importtime で計測し、予算を超えたら失敗する。
+
+    python -m benchmarks.import_time [--module src.gui] [--budget-ms 100] [--repeat 5]
+
+各モジュールを新しいプロセスで repeat 回 import し、最も短い累積時間を予算と比べる。
+起動時に読み込まれてはいけない重いモジュール (numpy / cv2 / PIL / requests) が読み込まれた場合も失敗する。
+終了コードは予算内なら 0、超えたら 1。
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+DEFAULT_MODULES = ["src.gui"]
+DEFAULT_BUDGET_MS = 100.0
+DEFAULT_FORBIDDEN = ["numpy", "cv2", "PIL", "requests"]
+
+
+def measure_import(module: str) -> Tuple[float, Dict[str, float]]:
+    """
+    新しいプロセスで module を import し、(module の累積時間 [ms], 読み込まれたモジュールごとの自身の時間 [ms]) を返す。
+    """
+    env = dict(os.environ)
+    # src.config は APPDATA を参照する (Windows 以外で計測する場合のため)
+    env.setdefault("APPDATA", tempfile.gettempdir())
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{module} を import できませんでした:\n{result.stderr[-2000:]}")
+
+    # 出力は子が親より先に並ぶので、module の行の直前にある最上位の行より後ろが module の読み込んだもの
+    total: Optional[float] = None
+    self_times: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        if not self_us.strip().isdigit():
+            continue  # 見出し行
+        self_times[name.strip()] = int(self_us) / 1000
+        if name[1:] != name.strip():
+            continue
+        if name.strip() == module:
+            total = int(cumulative_us) / 1000
+            break
+        self_times = {}
+    if total is None:
+        raise RuntimeError(f"{module} の import 時間が出力にありません。")
+    return total, self_times
+
+
+def check_module(module: str, budget_ms: float, forbidden: List[str], repeat: int, top: int) -> bool:
+    best = float("inf")
+    self_times: Dict[str, float] = {}
+    for _ in range(max(1, repeat)):
+        total, times = measure_import(module)
+        if total < best:
+            best, self_times = total, times
+
+    loaded = [name for name in forbidden if any(m == name or m.startswith(name + ".") for m in self_times)]
+    ok = best <= budget_ms and not loaded
+    print(f"{module}: {best:.1f} ms (予算 {budget_ms:.1f} ms) {'OK' if ok else 'NG'}")
+    for name, ms in sorted(self_times.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"  {ms:8.2f} ms  {name}")
+    if loaded:
+        print(f"  起動時に読み込まれたモジュール: {', '.join(loaded)}")
+    return ok
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", action="append", help=f"計測するモジュール (既定: {', '.join(DEFAULT_MODULES)})")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--forbid", action="append", help=f"読み込まれてはいけないモジュール (既定: {', '.join(DEFAULT_FORBIDDEN)})")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="自身の時間が長いモジュールを何件表示するか")
+    args = parser.parse_args()
+
+    results = [check_module(module, args.budget_ms, args.forbid or DEFAULT_FORBIDDEN, args.repeat, args.top)
+               for module in args.module or DEFAULT_MODULES]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
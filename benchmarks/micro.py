@@ -0,0 +1,191 @@
+"""
+スコア計算・背景画像の生成 (解像度違いの同時生成を含む)・ジャケットの変形・エイリアスの書き出しを合成データで計測する。
+
+    python -m benchmarks.micro [--save baseline.json] [--baseline baseline.json] [--threshold 0.25]
+
+各ケースを1回空回ししてから repeat 回実行して最短時間を取り、もう1回 tracemalloc 付きで実行して
+Python と numpy が確保したメモリの最大量を取る (cv2 / PIL 内部の確保は含まない)。
+--save で結果を JSON に保存し、--baseline で保存済みの結果と比べる。
+時間が threshold、メモリが memory-threshold の割合を超えて増えたケースがあれば終了コード 1 を返す。
+基準値は計測したマシンでしか意味が無いので、同じマシンで取ったもの同士を比べること。
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks import synthetic
+from src.modules import alias_writer, image_processor, score_calculator
+from src.modules.background_variant import BackgroundVariant
+from src.modules.level_context import LevelContext
+
+BASELINE_VERSION = 1
+
+# これより短い時間差は誤差として扱う (数ミリ秒のケースで割合だけ見ると不安定なため)
+MIN_DELTA_SECONDS = 0.002
+
+# 背景画像に渡すジャケットの大きさ (ダウンロード時にこの大きさにリサイズされる)
+BACKGROUND_JACKET_SIZE = 512
+
+# (ケース名, ノーツ数, BPM 変化数)
+SCORE_CASES = [
+    ("score_frames[1k]", 1000, 1),
+    ("score_frames[10k]", 10000, 1),
+    ("score_frames[10k,bpm500]", 10000, 500),
+    ("score_frames[50k,bpm50]", 50000, 50),
+]
+
+Case = Tuple[str, Callable[[], object]]
+
+
+def _quiet(func: Callable[[], object]) -> Callable[[], object]:
+    """計測対象の print を捨てる"""
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func()
+    return run
+
+
+def build_cases(work_dir: str) -> List[Case]:
+    cases: List[Case] = []
+    level_info = synthetic.make_level_item()
+
+    for name, note_count, bpm_changes in SCORE_CASES:
+        chart = synthetic.make_chart_columns(note_count, bpm_changes)
+        cases.append((name, lambda chart=chart: score_calculator._calculate_score_frames(level_info, chart, 250000)))
+
+    jackets = {size: synthetic.make_jacket(size).convert("RGBA") for size in synthetic.JACKET_SIZES}
+    for version in ("1", "3"):
+        quads = list(image_processor.QUADS[version].values())
+        for size, jacket in jackets.items():
+            cases.append((f"morph[v{version},{size}]",
+                          lambda jacket=jacket, quads=quads: [image_processor._morph(jacket, q, (1920, 1080)) for q in quads]))
+
+    background_jacket = synthetic.make_jacket(BACKGROUND_JACKET_SIZE)
+    for version in ("1", "3"):
+        dist_dir = os.path.join(work_dir, f"background_v{version}")
+        os.makedirs(dist_dir, exist_ok=True)
+        cases.append((f"background[v{version}]", _quiet(
+            lambda version=version, dist_dir=dist_dir: image_processor.generate_background_image(
+                "bench-1", version, dist_dir, jacket=background_jacket))))
+
+    variants_dir = os.path.join(work_dir, "background_variants")
+    os.makedirs(variants_dir, exist_ok=True)
+    variants = [BackgroundVariant("3"), BackgroundVariant("3", (3840, 2160))]
+    cases.append(("background_variants[v3,1080p+4k]", _quiet(
+        lambda: image_processor.generate_background_variants("bench-1", variants, variants_dir, jacket=background_jacket))))
+
+    alias_dir = os.path.join(work_dir, "alias")
+    os.makedirs(alias_dir, exist_ok=True)
+    context = LevelContext("bench-1", alias_dir, level_info)
+    extra_data = {"difficulty": "master", "vocal": "benchmark", "words": "-", "music": "-", "arrange": "-"}
+    cases.append(("alias", _quiet(lambda: alias_writer.generate_alias_object(context, 123.4, extra_data))))
+    return cases
+
+
+def measure(func: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """空回し後の最短時間 (秒) と、tracemalloc で取ったメモリの最大量 (バイト) を返す"""
+    func()
+    best = float("inf")
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": best, "peak_bytes": peak}
+
+
+def run_cases(cases: List[Case], repeat: int, selected: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+    results = {}
+    for name, func in cases:
+        if selected and not any(s in name for s in selected):
+            continue
+        results[name] = measure(func, repeat)
+        r = results[name]
+        print(f"{name:<34} {r['seconds'] * 1000:10.2f} ms {r['peak_bytes'] / 1e6:10.2f} MB")
+    return results
+
+
+def find_regressions(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                     threshold: float, memory_threshold: float) -> List[str]:
+    """基準値より threshold / memory_threshold の割合を超えて悪くなったケースの説明を返す"""
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        seconds, base_seconds = r["seconds"], base["seconds"]
+        if seconds > base_seconds * (1 + threshold) and seconds - base_seconds > MIN_DELTA_SECONDS:
+            regressions.append(f"{name}: 時間 {base_seconds * 1000:.2f} ms -> {seconds * 1000:.2f} ms "
+                               f"({seconds / base_seconds - 1:+.0%})")
+        peak, base_peak = r["peak_bytes"], base["peak_bytes"]
+        if base_peak and peak > base_peak * (1 + memory_threshold):
+            regressions.append(f"{name}: メモリ {base_peak / 1e6:.2f} MB -> {peak / 1e6:.2f} MB "
+                               f"({peak / base_peak - 1:+.0%})")
+    return regressions
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, float]]:
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != BASELINE_VERSION:
+        raise ValueError(f"基準値の形式が違います: {path}")
+    return data["cases"]
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]]):
+    data = {
+        "version": BASELINE_VERSION,
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "cases": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--case", action="append", help="名前にこの文字列を含むケースだけ計測する")
+    parser.add_argument("--save", help="結果を基準値として保存する JSON のパス")
+    parser.add_argument("--baseline", help="比べる基準値の JSON のパス")
+    parser.add_argument("--threshold", type=float, default=0.25, help="時間の増加をどの割合まで許すか")
+    parser.add_argument("--memory-threshold", type=float, default=0.10, help="メモリの増加をどの割合まで許すか")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline) if args.baseline else None
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = run_cases(build_cases(work_dir), args.repeat, args.case)
+
+    if args.save:
+        save_baseline(args.save, results)
+        print(f"基準値を '{args.save}' に保存しました。")
+    if baseline is None:
+        return 0
+
+    regressions = find_regressions(results, baseline, args.threshold, args.memory_threshold)
+    for line in regressions:
+        print(f"  悪化: {line}")
+    print("基準値と比べて悪化はありません。" if not regressions else f"{len(regressions)} 件の悪化があります。")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+skobj data の出力形式 (json / compact / lua) ごとのファイルサイズと読み込み時間を比較する。
+
+    python -m benchmarks.skobj_formats dist/<譜面ID>/skobj_data.json [--dkjson dkjson.lua]
+
+入力には従来形式 (json) の skobj_data.json を指定する。
+読み込み時間は Python の json.loads に加え、lupa がインストールされていれば
+Lua 上での dofile (lua 形式) と、--dkjson 指定時は dkjson の JSON.decode (json 形式) も計測する。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.modules import score_calculator
+
+
+def _best_of(func: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _make_lua_runtime():
+    try:
+        import lupa
+    except ImportError:
+        return None
+    try:
+        from lupa import luajit21 as lua_module
+    except ImportError:
+        lua_module = lupa
+    return lua_module.LuaRuntime(unpack_returned_tuples=True)
+
+
+def _lua_string(value: str) -> str:
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _lua_parse_time(lua, path: str, output_format: str, dkjson_path: Optional[str], repeat: int) -> Optional[float]:
+    if lua is None:
+        return None
+    if output_format == "lua":
+        load = lua.eval(f"function() return dofile({_lua_string(path)}) end")
+    elif dkjson_path:
+        lua.execute(f"BENCH_JSON = dofile({_lua_string(dkjson_path)})")
+        load = lua.eval(f"function() local f = io.open({_lua_string(path)}); local s = f:read('*a'); f:close(); return BENCH_JSON.decode(s) end")
+    else:
+        return None
+    return _best_of(load, repeat)
+
+
+def compare_formats(frames: List[Dict], output_dir: str, dkjson_path: Optional[str] = None, repeat: int = 3) -> List[Dict]:
+    """各形式で書き出し、サイズと読み込み時間を返す"""
+    lua = _make_lua_runtime()
+    results = []
+    for output_format in score_calculator.SKOBJ_FORMATS:
+        content = score_calculator.encode_skobj_data(frames, "", "bench", output_format)
+        ext = "lua" if output_format == "lua" else "json"
+        path = os.path.join(output_dir, f"skobj_{output_format}.{ext}")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+        python_time = None
+        if output_format != "lua":
+            python_time = _best_of(lambda: json.loads(content), repeat)
+        results.append({
+            "format": output_format,
+            "bytes": os.path.getsize(path),
+            "python_parse": python_time,
+            "lua_parse": _lua_parse_time(lua, os.path.abspath(path), output_format, dkjson_path, repeat),
+        })
+    return results
+
+
+def _format_seconds(value: Optional[float], base: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    if base:
+        return f"{value * 1000:9.1f} ms ({value / base:6.1%})"
+    return f"{value * 1000:9.1f} ms"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("skobj_json", help="従来形式の skobj_data.json")
+    parser.add_argument("--dkjson", help="Lua 上の JSON 読み込み時間を計測するための dkjson.lua")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output-dir", default=None, help="比較用ファイルの出力先 (既定: 入力と同じフォルダ)")
+    args = parser.parse_args()
+
+    with open(args.skobj_json, "r", encoding="utf-8") as f:
+        frames = json.load(f)["objects"]
+    output_dir = args.output_dir or os.path.dirname(os.path.abspath(args.skobj_json))
+
+    results = compare_formats(frames, output_dir, args.dkjson, args.repeat)
+    base = results[0]
+    print(f"{'format':<8} {'size':>22} {'python parse':>24} {'lua parse':>24}")
+    for r in results:
+        size = f"{r['bytes'] / 1024:9.1f} KiB ({r['bytes'] / base['bytes']:6.1%})"
+        print(f"{r['format']:<8} {size:>22} {_format_seconds(r['python_parse'], base['python_parse']):>24} "
+              f"{_format_seconds(r['lua_parse'], base['lua_parse']):>24}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
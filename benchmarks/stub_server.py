@@ -0,0 +1,257 @@
+"""
+Sonolus 互換のスタブサーバー。ネットワークに繋がずに downloader や Generator を動かすために使う。
+
+    python -m benchmarks.stub_server [--port 8000] [--bandwidth-kbps 2000] [--latency-ms 50] [--failure-rate 0.1]
+
+/sonolus/levels/<譜面ID> に譜面の情報 (item) の JSON を返し、
+/sonolus/repository/<譜面ID>/ 以下でジャケット (cover.jpg)・BGM (bgm.mp3)・gzip 圧縮した譜面 (chart.json.gz) を返す。
+内容は --fixtures のフォルダにある同名のファイルか、無ければ譜面IDから作った合成データ。
+ETag と Range に対応し、帯域・応答までの遅延・失敗 (503 か途中での切断) を指定できる。
+起動すると SERVER_MAP を向けるための環境変数を表示する。
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, Optional, Tuple
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks import synthetic
+from src.config import SERVER_MAP_ENV
+
+LEVELS_PATH = "/sonolus/levels/"
+REPOSITORY_PATH = "/sonolus/repository/"
+FIXTURE_NAMES = ("cover.jpg", "bgm.mp3", "chart.json.gz")
+DEFAULT_PREFIX = "stub"
+
+# 帯域を制限するときに1回で送るバイト数
+_SEND_CHUNK = 16 * 1024
+
+
+class StubServer:
+    """
+    別スレッドで動くスタブサーバー。with で起動・停止する。
+    bandwidth は1つの応答あたりのバイト/秒 (0 なら無制限)、latency は応答を返し始めるまでの秒数。
+    failure_rate の割合のファイル取得を 503 か途中での切断で失敗させる (api_failure_rate は譜面の情報の取得)。
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, bandwidth: int = 0, latency: float = 0.0,
+                 failure_rate: float = 0.0, api_failure_rate: float = 0.0, fixtures_dir: Optional[str] = None,
+                 note_count: int = 3000, jacket_size: int = 700, bgm_bytes: int = 3_000_000, seed: int = 0):
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.api_failure_rate = api_failure_rate
+        self.note_count = note_count
+        self.jacket_size = jacket_size
+        self.stats = {"requests": 0, "bytes": 0, "failures": 0}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._files: Dict[Tuple[str, str], bytes] = {}
+        self._fixtures = self._read_fixtures(fixtures_dir)
+        # BGM の中身は再生されないので、圧縮できないバイト列を全譜面で共有する
+        self._bgm = self._fixtures.get("bgm.mp3") or random.Random(seed).randbytes(bgm_bytes)
+        self._server = ThreadingHTTPServer((host, port), _StubHandler)
+        self._server.daemon_threads = True
+        self._server.stub = self
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _read_fixtures(fixtures_dir: Optional[str]) -> Dict[str, bytes]:
+        fixtures = {}
+        for name in FIXTURE_NAMES if fixtures_dir else ():
+            path = os.path.join(fixtures_dir, name)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    fixtures[name] = f.read()
+        return fixtures
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def levels_url(self) -> str:
+        return self.base_url + LEVELS_PATH
+
+    def server_map_env(self, prefix: str = DEFAULT_PREFIX) -> Dict[str, str]:
+        """prefix の譜面をこのサーバーから取得させる環境変数"""
+        return {SERVER_MAP_ENV: json.dumps({prefix: self.levels_url})}
+
+    def start(self) -> "StubServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "StubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def prepare(self, level_ids: Iterable[str]):
+        """合成データを先に作っておく (計測中に作るとその分が応答時間に入るため)"""
+        for level_id in level_ids:
+            for name in FIXTURE_NAMES:
+                self.file(level_id, name)
+
+    def file(self, level_id: str, name: str) -> bytes:
+        """譜面IDとファイル名に対応する内容を返す"""
+        if name in self._fixtures:
+            return self._fixtures[name]
+        if name == "bgm.mp3":
+            return self._bgm
+        with self._lock:
+            content = self._files.get((level_id, name))
+        if content is not None:
+            return content
+
+        # 譜面IDから種を決めて、譜面ごとに違う (描画キャッシュに当たらない) 内容にする
+        seed = zlib.crc32(level_id.encode())
+        if name == "cover.jpg":
+            buffer = io.BytesIO()
+            synthetic.make_jacket(self.jacket_size, seed).save(buffer, "jpeg", quality=90)
+            content = buffer.getvalue()
+        else:
+            chart = synthetic.make_chart(self.note_count, bpm_changes=20, seed=seed)
+            content = gzip.compress(json.dumps(chart).encode())
+        with self._lock:
+            self._files[(level_id, name)] = content
+        return content
+
+    def level_item(self, level_id: str) -> Dict:
+        return synthetic.make_level_item(level_id, base_url=self.base_url)
+
+    def should_fail(self, rate: float) -> bool:
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+    def count(self, key: str, value: int = 1):
+        with self._lock:
+            self.stats[key] += value
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        stub: StubServer = self.server.stub
+        stub.count("requests")
+        if stub.latency:
+            time.sleep(stub.latency)
+
+        path = self.path.split("?", 1)[0]
+        if path.startswith(LEVELS_PATH):
+            if stub.should_fail(stub.api_failure_rate):
+                return self._fail_status(stub)
+            body = json.dumps({"item": stub.level_item(path[len(LEVELS_PATH):])}).encode()
+            return self._send(stub, 200, body, {"Content-Type": "application/json"})
+
+        parts = path[len(REPOSITORY_PATH):].split("/") if path.startswith(REPOSITORY_PATH) else []
+        if len(parts) != 2 or parts[1] not in FIXTURE_NAMES:
+            return self._send(stub, 404, b"not found", {})
+        body = stub.file(*parts)
+        etag = f'"{zlib.crc32(body):08x}-{len(body)}"'
+        if self.headers.get("If-None-Match") == etag:
+            return self._send(stub, 304, b"", {"ETag": etag})
+        if stub.should_fail(stub.failure_rate):
+            # 失敗の半分は 503、残りは本文の途中で切断する
+            if stub.should_fail(0.5):
+                return self._fail_status(stub)
+            return self._send(stub, 200, body, {"ETag": etag}, truncate=True)
+
+        start = self._range_start(etag, len(body))
+        headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+        if start:
+            headers["Content-Range"] = f"bytes {start}-{len(body) - 1}/{len(body)}"
+            return self._send(stub, 206, body[start:], headers)
+        return self._send(stub, 200, body, headers)
+
+    def _range_start(self, etag: str, size: int) -> int:
+        value = self.headers.get("Range", "")
+        if_range = self.headers.get("If-Range")
+        if not value.startswith("bytes=") or (if_range is not None and if_range != etag):
+            return 0
+        start = value[len("bytes="):].split("-", 1)[0]
+        return int(start) if start.isdigit() and int(start) < size else 0
+
+    def _fail_status(self, stub: StubServer):
+        stub.count("failures")
+        self._send(stub, 503, b"service unavailable", {"Retry-After": "0"})
+
+    def _send(self, stub: StubServer, status: int, body: bytes, headers: Dict[str, str], truncate: bool = False):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        payload = memoryview(body)
+        if truncate:
+            stub.count("failures")
+            payload = payload[:len(body) // 2]
+        sent = 0
+        while sent < len(payload):
+            chunk = payload[sent:sent + (_SEND_CHUNK if stub.bandwidth else len(payload))]
+            try:
+                self.wfile.write(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+                return
+            sent += len(chunk)
+            stub.count("bytes", len(chunk))
+            if stub.bandwidth:
+                time.sleep(len(chunk) / stub.bandwidth)
+        if truncate:
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--prefix", default=DEFAULT_PREFIX, help="SERVER_MAP に追加する接頭辞")
+    parser.add_argument("--fixtures", help="cover.jpg / bgm.mp3 / chart.json.gz を置いたフォルダ")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0, help="1つの応答あたりの帯域 (KB/秒, 0 なら無制限)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="応答を返し始めるまでの遅延")
+    parser.add_argument("--failure-rate", type=float, default=0, help="ファイルの取得を失敗させる割合")
+    parser.add_argument("--api-failure-rate", type=float, default=0, help="譜面の情報の取得を失敗させる割合")
+    parser.add_argument("--notes", type=int, default=3000, help="合成する譜面のノーツ数")
+    args = parser.parse_args()
+
+    stub = StubServer(args.host, args.port, int(args.bandwidth_kbps * 1000), args.latency_ms / 1000,
+                      args.failure_rate, args.api_failure_rate, args.fixtures, args.notes)
+    with stub:
+        for key, value in stub.server_map_env(args.prefix).items():
+            print(f"{key}={value}")
+        print(f"{stub.levels_url}{args.prefix}-<ID> で待ち受けています (Ctrl+C で終了)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+ベンチマーク用の合成データ (譜面・ジャケット・譜面の情報) を作る。
+
+乱数の種を固定しているので、同じ引数なら何度呼んでも同じデータになる。
+"""
+import os
+import random
+import sys
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.config import WEIGHT_MAP
+from src.modules.chart_columns import ChartColumns, build_chart_columns
+
+# 実際の譜面に近いアーキタイプの出現比率 (名前は WEIGHT_MAP のもの)
+DEFAULT_ARCHETYPE_MIX = {
+    "NormalTapNote": 30, "CriticalTapNote": 4, "NormalFlickNote": 6, "CriticalFlickNote": 1,
+    "NormalSlideStartNote": 5, "NormalSlideEndNote": 5, "CriticalSlideStartNote": 1, "CriticalSlideEndNote": 1,
+    "NormalSlideTickNote": 12, "NormalAttachedSlideTickNote": 4, "HiddenSlideTickNote": 2,
+    "NormalTraceNote": 4, "DamageNote": 1,
+    "NormalSlideConnector": 10, "SimLine": 8,
+}
+
+JACKET_SIZES = (256, 512, 1024)
+
+# BPM 変化で選ぶテンポ
+_BPM_CHOICES = (90.0, 120.0, 145.0, 160.0, 175.5, 200.0, 240.0)
+
+
+def make_chart(note_count: int, bpm_changes: int = 1, archetype_mix: Optional[Dict[str, float]] = None,
+               seed: int = 0) -> Dict[str, Any]:
+    """
+    Sonolus 形式の譜面 (chart.json の内容) を作る。
+    note_count 個のエンティティを archetype_mix の比率で選び、1/4 拍刻みで並べる。
+    bpm_changes 個の #BPM_CHANGE を置く (最初の1つは 0 拍目)。
+    """
+    mix = archetype_mix or DEFAULT_ARCHETYPE_MIX
+    unknown = [name for name in mix if name not in WEIGHT_MAP]
+    if unknown:
+        raise ValueError(f"WEIGHT_MAP にないアーキタイプです: {', '.join(unknown)}")
+    if bpm_changes < 1:
+        raise ValueError("bpm_changes は1以上にしてください。")
+
+    rng = random.Random(seed)
+    names = list(mix)
+    archetypes = rng.choices(names, weights=[mix[name] for name in names], k=note_count)
+
+    entities: List[Dict[str, Any]] = [{"archetype": "Initialization"}, {"archetype": "Stage"}]
+    beat = 0.0
+    for archetype in archetypes:
+        beat += rng.choice((0.0, 0.25, 0.5, 0.5, 1.0))
+        entities.append({"archetype": archetype, "data": [
+            {"name": "#BEAT", "value": beat},
+            {"name": "lane", "value": rng.randint(-5, 5)},
+            {"name": "size", "value": rng.choice((1.5, 2.0, 3.0))},
+        ]})
+
+    change_beats = [0.0] + sorted(round(rng.uniform(0.0, max(beat, 1.0)) * 4) / 4 for _ in range(bpm_changes - 1))
+    for change_beat in change_beats:
+        entities.append({"archetype": "#BPM_CHANGE", "data": [
+            {"name": "#BEAT", "value": change_beat},
+            {"name": "#BPM", "value": rng.choice(_BPM_CHOICES)},
+        ]})
+
+    # 実際の譜面と同じく、エンティティは拍順に並んでいるとは限らない
+    rng.shuffle(entities)
+    return {"bgmOffset": 0, "entities": entities}
+
+
+def make_chart_columns(note_count: int, bpm_changes: int = 1, archetype_mix: Optional[Dict[str, float]] = None,
+                       seed: int = 0) -> ChartColumns:
+    """make_chart の譜面から ChartColumns を作る"""
+    return build_chart_columns(make_chart(note_count, bpm_changes, archetype_mix, seed)["entities"])
+
+
+def make_jacket(size: int = 512, seed: int = 0) -> Image.Image:
+    """size x size の RGB のジャケット画像を作る (グラデーションと図形とノイズで、実際の画像程度に圧縮しにくくする)"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    phases = rng.uniform(0, 2 * np.pi, 3)
+    channels = [0.5 + 0.5 * np.sin(2 * np.pi * (x * (1 + i) + y * (2 - i)) + phases[i]) for i in range(3)]
+    pixels = np.stack(channels, axis=-1) * 200
+
+    for _ in range(12):
+        cx, cy, radius = rng.uniform(0, 1), rng.uniform(0, 1), rng.uniform(0.05, 0.25)
+        inside = (x - cx) ** 2 + (y - cy) ** 2 < radius ** 2
+        pixels[inside] = rng.uniform(0, 255, 3)
+
+    pixels += rng.normal(0, 12, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+
+
+def make_level_item(level_id: str = "bench-1", rating: int = 30, base_url: str = "") -> Dict[str, Any]:
+    """API の応答の item に相当する譜面の情報を作る (URL は base_url からの相対)"""
+    return {
+        "name": level_id,
+        "rating": rating,
+        "title": f"Synthetic {level_id}",
+        "artists": "benchmark",
+        "author": "benchmark",
+        "cover": {"url": f"{base_url}/sonolus/repository/{level_id}/cover.jpg"},
+        "bgm": {"url": f"{base_url}/sonolus/repository/{level_id}/bgm.mp3"},
+        "data": {"url": f"{base_url}/sonolus/repository/{level_id}/chart.json.gz"},
+    }
@@ -0,0 +1,150 @@
+"""
+スタブサーバーを相手にバッチ生成を並列数ごとに実行し、スループットと1譜面あたりの所要時間を計測する。
+
+    python -m benchmarks.throughput [--levels 8] [--concurrency 1 2 4] [--bandwidth-kbps 2000] [--latency-ms 50]
+
+並列数ごとに新しい譜面IDで levels 個の譜面を run_batch で生成し、
+成功した譜面の数から 譜面/分 を、譜面ごとの所要時間から p50 / p95 を出す。
+ダウンロードのキャッシュと描画キャッシュは使わず、前回の生成内容 (manifest.json) も無視して毎回すべて生成する。
+生成したファイル (dist/<譜面ID>) は計測後に削除する。
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Any, Dict, Iterator, List
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from benchmarks.stub_server import DEFAULT_PREFIX, StubServer
+from src import batch, config
+from src.utils import get_app_root
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """values の q パーセンタイル (線形補間)"""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+@contextlib.contextmanager
+def _silence_stdout() -> Iterator[None]:
+    """ワーカープロセスも含めて標準出力を捨てる (ワーカーは起動時にファイル記述子を引き継ぐ)"""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    try:
+        os.dup2(devnull, 1)
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+        os.close(devnull)
+
+
+def _point_server_map(stub: StubServer, prefix: str):
+    """prefix の譜面をスタブサーバーから取得させる (spawn で起動するワーカーには環境変数で伝わる)"""
+    os.environ.update(stub.server_map_env(prefix))
+    config.SERVER_MAP.update(config._load_server_map_override())
+
+
+def run_round(stub: StubServer, level_ids: List[str], jobs: int, network_slots: int, bg_version: str,
+              verbose: bool) -> Dict[str, Any]:
+    defaults = {
+        "bg_version": bg_version,
+        "team_power": 250000.0,
+        "app_version": config.APP_VERSION,
+        "skobj_format": "json",
+        "open_output_folder": False,
+        "force_rebuild": True,
+        "http_cache": False,
+        "background_render_cache": False,
+        "extra_data": {key: "" for key in batch.EXTRA_DATA_KEYS},
+    }
+    level_configs = batch.build_level_configs(level_ids, None, defaults)
+    stub.prepare(level_ids)
+
+    failures_before = stub.stats["failures"]
+    start = time.perf_counter()
+    try:
+        with contextlib.nullcontext() if verbose else _silence_stdout():
+            results = batch.run_batch(level_configs, jobs, network_slots)
+    finally:
+        for level_id in level_ids:
+            shutil.rmtree(os.path.join(get_app_root(), "dist", level_id), ignore_errors=True)
+    elapsed = time.perf_counter() - start
+
+    seconds = [r["seconds"] for r in results if r["success"]]
+    return {
+        "concurrency": jobs,
+        "network_slots": network_slots,
+        "levels": len(results),
+        "succeeded": len(seconds),
+        "elapsed": elapsed,
+        "levels_per_minute": len(seconds) / elapsed * 60 if elapsed > 0 else 0.0,
+        "p50": _percentile(seconds, 50),
+        "p95": _percentile(seconds, 95),
+        "injected_failures": stub.stats["failures"] - failures_before,
+        "errors": [r["message"].strip() for r in results if not r["success"]],
+    }
+
+
+def _format_seconds(value: float) -> str:
+    return "-" if value != value else f"{value:.2f}s"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, default=8, help="並列数ごとに生成する譜面の数")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4], help="同時に生成する譜面の数")
+    parser.add_argument("--network-slots", type=int, default=None, help="同時にダウンロードする譜面の数 (既定: 並列数と同じ)")
+    parser.add_argument("--bg-version", choices=["3", "1"], default="3")
+    parser.add_argument("--bandwidth-kbps", type=float, default=0, help="1つの応答あたりの帯域 (KB/秒, 0 なら無制限)")
+    parser.add_argument("--latency-ms", type=float, default=0, help="応答を返し始めるまでの遅延")
+    parser.add_argument("--failure-rate", type=float, default=0, help="ファイルの取得を失敗させる割合")
+    parser.add_argument("--api-failure-rate", type=float, default=0, help="譜面の情報の取得を失敗させる割合")
+    parser.add_argument("--notes", type=int, default=3000, help="合成する譜面のノーツ数")
+    parser.add_argument("--fixtures", help="cover.jpg / bgm.mp3 / chart.json.gz を置いたフォルダ")
+    parser.add_argument("--output", help="結果を保存する JSON のパス")
+    parser.add_argument("--verbose", action="store_true", help="生成中のログを表示する")
+    args = parser.parse_args()
+
+    stub = StubServer(bandwidth=int(args.bandwidth_kbps * 1000), latency=args.latency_ms / 1000,
+                      failure_rate=args.failure_rate, api_failure_rate=args.api_failure_rate,
+                      fixtures_dir=args.fixtures, note_count=args.notes)
+    rounds = []
+    with stub:
+        _point_server_map(stub, DEFAULT_PREFIX)
+        # 譜面IDを実行ごとに変え、前回の実行の出力やサーバー側の合成データと混ざらないようにする
+        tag = f"{int(time.time()) % 100000}p{os.getpid()}"
+        print(f"{'並列数':<6} {'枠':>3} {'成功':>7} {'全体':>9} {'譜面/分':>8} {'p50':>8} {'p95':>8} {'注入した失敗':>12}")
+        for jobs in args.concurrency:
+            level_ids = [f"{DEFAULT_PREFIX}-b{tag}c{jobs}n{i}" for i in range(args.levels)]
+            r = run_round(stub, level_ids, jobs, args.network_slots or jobs, args.bg_version, args.verbose)
+            rounds.append(r)
+            print(f"{r['concurrency']:<6} {r['network_slots']:>3} {r['succeeded']:>3}/{r['levels']:<3} "
+                  f"{r['elapsed']:8.2f}s {r['levels_per_minute']:8.1f} {_format_seconds(r['p50']):>8} {_format_seconds(r['p95']):>8} "
+                  f"{r['injected_failures']:>12}")
+            for error in r["errors"]:
+                print(f"  失敗: {error}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"stub": {"bandwidth": stub.bandwidth, "latency": stub.latency,
+                                "failure_rate": stub.failure_rate, "api_failure_rate": stub.api_failure_rate,
+                                "notes": stub.note_count},
+                       "rounds": rounds}, f, indent=2, ensure_ascii=False)
+    return 0 if all(r["succeeded"] == r["levels"] for r in rounds) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,227 @@
+"""
+GUI を使わずに複数の譜面をまとめて生成する。
+
+    python run_batch.py chcy-xxxx UnCh-yyyy --team-power 300000
+    python run_batch.py --file levels.json --jobs 4 --network-slots 2
+
+--file にはテキスト (1行に1つの譜面ID、# 以降はコメント) か JSON を指定できる。
+JSON は譜面IDの文字列、または次のようなオブジェクトのリスト (もしくは {"defaults": {...}, "levels": [...]}):
+
+    {"full_level_id": "chcy-xxxx", "team_power": 300000, "bg_version": "1", "extra_data": {"title": "..."}}
+
+このモジュールは tkinter を読み込まない。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+
+from src import config
+from src.generator import Generator
+
+EXTRA_DATA_KEYS = ["title", "author", "words", "music", "arrange", "vocal", "difficulty"]
+
+DEFAULT_JOBS = min(4, os.cpu_count() or 1)
+DEFAULT_NETWORK_SLOTS = 2
+
+# ワーカープロセスで共有するダウンロード枠 (_init_worker で設定する)
+_network_slots = None
+
+
+def _read_level_file(path: str) -> Any:
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+    if path.lower().endswith(".json"):
+        return json.loads(text)
+    return [line.split('#', 1)[0].strip() for line in text.splitlines() if line.split('#', 1)[0].strip()]
+
+
+def _check_extra_data(extra_data: Any, where: str) -> Dict[str, Any]:
+    """extra_data が {"キー": 文字列} の形か確認する"""
+    if not isinstance(extra_data, dict) or not all(isinstance(v, str) for v in extra_data.values()):
+        raise ValueError(f"{where} の extra_data は {{\"キー\": \"文字列\"}} の形で指定してください: {extra_data!r}")
+    return extra_data
+
+
+def _merge_level(defaults: Dict[str, Any], entry: Any) -> Dict[str, Any]:
+    """defaults に譜面ごとの指定を上書きして、Generator に渡す設定を作る"""
+    if isinstance(entry, str):
+        entry = {"full_level_id": entry}
+    if not isinstance(entry, dict) or not isinstance(entry.get("full_level_id"), str) or not entry["full_level_id"].strip():
+        raise ValueError(f"譜面の指定が不正です: {entry}")
+    level_id = entry["full_level_id"].strip()
+
+    level_config = dict(defaults)
+    level_config.update({k: v for k, v in entry.items() if k != "extra_data"})
+    level_config["extra_data"] = dict(defaults.get("extra_data", {}),
+                                      **_check_extra_data(entry.get("extra_data", {}), level_id))
+    level_config["full_level_id"] = level_id
+
+    team_power = level_config["team_power"]
+    if isinstance(team_power, bool) or not isinstance(team_power, (int, float, str)):
+        raise ValueError(f"{level_id} の team_power は数値で指定してください: {team_power!r}")
+    try:
+        level_config["team_power"] = float(team_power)
+    except ValueError:
+        raise ValueError(f"{level_id} の team_power は数値で指定してください: {team_power!r}")
+    bg_version = level_config["bg_version"]
+    if isinstance(bg_version, bool) or not isinstance(bg_version, (int, str)):
+        raise ValueError(f"{level_id} の bg_version は \"3\" か \"1\" で指定してください: {bg_version!r}")
+    level_config["bg_version"] = str(bg_version)
+    return level_config
+
+
+def build_level_configs(level_ids: List[str], level_file: Optional[str], defaults: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    コマンドラインの譜面IDとファイルの内容から、譜面ごとの設定のリストを作る。
+    同じ譜面IDが複数あるとワーカーが同じ dist/<譜面ID> に同時に書き込むため、ValueError にする。
+    """
+    entries: List[Any] = list(level_ids)
+    if level_file:
+        data = _read_level_file(level_file)
+        if isinstance(data, dict):
+            file_defaults = data.get("defaults", {})
+            if not isinstance(file_defaults, dict):
+                raise ValueError(f"defaults はオブジェクトで指定してください: {file_defaults!r}")
+            defaults = dict(defaults, **{k: v for k, v in file_defaults.items() if k != "extra_data"})
+            defaults["extra_data"] = dict(defaults.get("extra_data", {}),
+                                          **_check_extra_data(file_defaults.get("extra_data", {}), "defaults"))
+            data = data.get("levels", [])
+        if not isinstance(data, list):
+            raise ValueError("譜面の一覧はリストで指定してください。")
+        entries.extend(data)
+    level_configs = [_merge_level(defaults, entry) for entry in entries]
+
+    seen = set()
+    duplicates = []
+    for level_config in level_configs:
+        level_id = level_config["full_level_id"]
+        if level_id in seen and level_id not in duplicates:
+            duplicates.append(level_id)
+        seen.add(level_id)
+    if duplicates:
+        raise ValueError(f"同じ譜面IDが複数回指定されています: {', '.join(duplicates)}")
+    return level_configs
+
+
+def _init_worker(network_slots):
+    global _network_slots
+    _network_slots = network_slots
+
+
+def _run_level(level_config: Dict[str, Any]) -> Dict[str, Any]:
+    """ワーカープロセスで1つの譜面を生成し、結果と所要時間を返す"""
+    level_id = level_config["full_level_id"]
+    start = time.perf_counter()
+    prefix = f"[{level_id}]"
+
+    def report(message: str):
+        print(message if message.startswith(prefix) else f"{prefix} {message}", flush=True)
+
+    generator = Generator(level_config, report, network_slots=_network_slots)
+    success, message = generator.run()
+    return {"full_level_id": level_id, "success": success, "message": message,
+            "seconds": time.perf_counter() - start}
+
+
+def run_batch(level_configs: List[Dict[str, Any]], jobs: int = DEFAULT_JOBS,
+              network_slots: int = DEFAULT_NETWORK_SLOTS) -> List[Dict[str, Any]]:
+    """
+    譜面ごとの設定をプロセスプールで並列に生成する。
+    ダウンロードは network_slots 個までしか同時に行わない (残りのプロセスは描画などを進める)。
+    """
+    context = multiprocessing.get_context()
+    slots = context.Semaphore(max(1, network_slots))
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, jobs), mp_context=context,
+                             initializer=_init_worker, initargs=(slots,)) as executor:
+        futures = {executor.submit(_run_level, level_config): level_config for level_config in level_configs}
+        for future in as_completed(futures):
+            level_id = futures[future]["full_level_id"]
+            try:
+                result = future.result()
+            except Exception as e:
+                # ワーカープロセスが異常終了した場合など
+                result = {"full_level_id": level_id, "success": False, "message": str(e), "seconds": 0.0}
+            results.append(result)
+    order = {level_config["full_level_id"]: i for i, level_config in enumerate(level_configs)}
+    results.sort(key=lambda r: order.get(r["full_level_id"], len(order)))
+    return results
+
+
+def format_summary(results: List[Dict[str, Any]], elapsed: float) -> str:
+    lines = ["", "=== 生成結果 ==="]
+    width = max([len(r["full_level_id"]) for r in results] + [8])
+    for result in results:
+        status = "成功" if result["success"] else "失敗"
+        lines.append(f"{result['full_level_id']:<{width}}  {status}  {result['seconds']:7.2f}秒")
+    failures = [r for r in results if not r["success"]]
+    for result in failures:
+        lines.append(f"[{result['full_level_id']}] {result['message'].strip()}")
+    succeeded = len(results) - len(failures)
+    rate = succeeded / elapsed * 60 if elapsed > 0 else 0.0
+    lines.append(f"成功 {succeeded} / 失敗 {len(failures)}  全体 {elapsed:.2f}秒  ({rate:.1f} 譜面/分)")
+    return "\n".join(lines)
+
+
+def _parse_args(argv: Optional[List[str]]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="複数の譜面のオーバーレイをまとめて生成します。")
+    parser.add_argument("level_ids", nargs="*", help="譜面ID (例: chcy-xxxx)")
+    parser.add_argument("-f", "--file", help="譜面IDの一覧 (テキストまたは JSON)")
+    parser.add_argument("--team-power", type=float, default=250000.0, help="チーム総合力 (既定: 250000)")
+    parser.add_argument("--bg-version", choices=["3", "1"], default="3", help="背景バージョン (既定: 3)")
+    parser.add_argument("--bg-variant", action="append", metavar="VERSION@WxH",
+                        help="background.png とは別に出力する背景画像 (例: 3@3840x2160、複数指定可)")
+    parser.add_argument("--difficulty", default="master", help="難易度 (既定: master)")
+    parser.add_argument("--skobj-format", choices=["json", "compact", "lua"], default="json",
+                        help="compact / lua は GUI のセットアップでスクリプトを更新してから使う")
+    parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_JOBS, help="同時に生成する譜面の数")
+    parser.add_argument("--network-slots", type=int, default=DEFAULT_NETWORK_SLOTS,
+                        help="同時にダウンロードする譜面の数")
+    parser.add_argument("--draft", action="store_true",
+                        help="編集中のプレビュー用に背景画像とアセットを縮小して生成する (外して生成し直すと元の品質に戻る)")
+    parser.add_argument("--force", action="store_true", help="前回から変わっていない工程も含めてすべて生成し直す")
+    parser.add_argument("--dry-run", action="store_true", help="生成はせず、生成し直す工程だけを表示する")
+    parser.add_argument("--trace", action="store_true",
+                        help="工程ごとの計測結果を dist/<譜面ID>/trace.json (Chrome のトレース形式) に保存する")
+    parser.add_argument("--profile", action="append", metavar="STAGE",
+                        help="指定した工程 (all なら全て) を cProfile で計測し、dist/<譜面ID>/profile/ に保存する")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = _parse_args(argv)
+    defaults = {
+        "bg_version": args.bg_version,
+        "team_power": args.team_power,
+        "background_variants": args.bg_variant or [],
+        "app_version": config.APP_VERSION,
+        "skobj_format": args.skobj_format,
+        "open_output_folder": False,
+        "draft": args.draft,
+        "force_rebuild": args.force,
+        "dry_run": args.dry_run,
+        "trace": args.trace,
+        "profile": args.profile or [],
+        "extra_data": {key: "" for key in EXTRA_DATA_KEYS},
+    }
+    defaults["extra_data"]["difficulty"] = args.difficulty
+
+    try:
+        level_configs = build_level_configs(args.level_ids, args.file, defaults)
+    except (OSError, ValueError) as e:
+        print(f"譜面の一覧を読み込めませんでした: {e}", file=sys.stderr)
+        return 2
+    if not level_configs:
+        print("譜面IDが指定されていません。", file=sys.stderr)
+        return 2
+
+    print(f"{len(level_configs)} 譜面を生成します (並列数 {args.jobs}, ダウンロード枠 {args.network_slots})")
+    start = time.perf_counter()
+    results = run_batch(level_configs, args.jobs, args.network_slots)
+    print(format_summary(results, time.perf_counter() - start))
+    return 0 if all(r["success"] for r in results) else 1
@@ -1,15 +1,31 @@
 import os
+import json
 
-APP_VERSION = "0.1.0"
+# @SekaiObjects.obj2 を変更したら必ず上げる。セットアップはこの値が変わったときだけスクリプトを入れ直し、
+# スクリプトは skobj_data のバージョンが違うと描画せずに Version mismatch を表示する
+APP_VERSION = "0.2.0"
 
 UPDATE_CHECK_URL = "https://raw.githubusercontent.com/Hallkun19/SekaiOverlay/refs/heads/main/data.json"
 RELEASE_PAGE_URL = "https://github.com/Hallkun19/SekaiOverlay/releases/latest"
 
 CONFIG_DIR = os.path.join(os.getenv('APPDATA'), 'SekaiOverlay')
 CONFIG_PATH = os.path.join(CONFIG_DIR, 'config.ini')
+CACHE_DIR = os.path.join(CONFIG_DIR, 'cache')
+
+# 生成済み背景画像のキャッシュの上限サイズ (超えたら使われていないものから削除する)
+RENDER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# ダウンロードしたファイル (ジャケット・BGM・譜面) のキャッシュの上限サイズ
+HTTP_CACHE_MAX_BYTES = 1024 * 1024 * 1024
 
 AVIUTL_SCRIPT_DIR = "C:\\ProgramData\\aviutl2\\Script"
 
+# ドラフト (編集中のプレビュー用) で背景画像と HUD などのアセットを縮小する倍率
+DRAFT_SCALE = 0.5
+
+# skobj_data.json のフレーム索引を計算するフレームレート (AviUtl側のプロジェクト設定に合わせる)
+SKOBJ_INDEX_FPS = 60
+
 UNMULT_ANM_URL = "https://gist.githubusercontent.com/mes51/f90331af552231f39adb5ed3847ebe86/raw/121c5a97d7d776270bdb81febdcf12e79b257466/unmult.anm2"
 DKJSON_LUA_URL = "https://raw.githubusercontent.com/LuaDist/dkjson/refs/heads/master/dkjson.lua"
 
@@ -20,6 +36,33 @@ SERVER_MAP = {
     "coconut-next-sekai": "https://coconut.sonolus.com/next-sekai/levels/"
 }
 
+# {"接頭辞": "URL", ...} の JSON を指定すると SERVER_MAP に追加・上書きする (ローカルのスタブサーバーで試すため)
+SERVER_MAP_ENV = "SEKAI_OVERLAY_SERVER_MAP"
+
+
+def _load_server_map_override() -> dict:
+    value = os.getenv(SERVER_MAP_ENV)
+    if not value:
+        return {}
+    try:
+        override = json.loads(value)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"環境変数 {SERVER_MAP_ENV} の JSON を解析できませんでした: {e}")
+    if not isinstance(override, dict) or not all(isinstance(v, str) for v in override.values()):
+        raise ValueError(f"環境変数 {SERVER_MAP_ENV} には {{\"接頭辞\": \"URL\"}} の形の JSON を指定してください。")
+    return override
+
+
+SERVER_MAP.update(_load_server_map_override())
+
+
+def get_installed_script_version():
+    """セットアップで最後に @SekaiObjects.obj2 をインストールしたときの APP_VERSION (未インストールなら None)"""
+    import configparser
+    parser = configparser.ConfigParser()
+    parser.read(CONFIG_PATH)
+    return parser.get('AppInfo', 'LastVersion', fallback=None)
+
 WEIGHT_MAP = {
     # CC
     "#BPM_CHANGE": 0, "Initialization": 0, "InputManager": 0, "Stage": 0,
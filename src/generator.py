@@ -1,15 +1,24 @@
 import os
 import sys 
 import subprocess
-from typing import Callable
-from src.modules import downloader, image_processor, score_calculator, alias_writer
-from src import config
-from src.utils import get_app_root
+import contextlib
+from typing import Callable, ContextManager, Optional
+from src.pipeline import Manifest, Pipeline, Stage
+from src import config, tracing
+from src.utils import get_app_root, resource_path
+
+MANIFEST_FILENAME = "manifest.json"
+CHART_COLUMNS_FILENAME = "chart_columns.npz"
+TRACE_FILENAME = "trace.json"
+PROFILE_DIRNAME = "profile"
 
 class Generator:
-    def __init__(self, config: dict, status_callback: Callable[[str], None]):
+    def __init__(self, config: dict, status_callback: Callable[[str], None],
+                 network_slots: Optional[ContextManager] = None):
         self.config = config
         self.update_status = status_callback
+        # ダウンロード中だけ確保する枠 (バッチ処理で同時ダウンロード数を制限するためのセマフォなど)
+        self.network_slots = network_slots
         self.script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         self.app_root = get_app_root()
 
@@ -26,42 +35,203 @@ class Generator:
             # ★ 出力先ディレクトリのフルパスをここで一元管理
             dist_dir = os.path.join(self.app_root, "dist", full_level_id)
 
-            # 2. ダウンロード (★ dist_dirを渡す)
+            # 2〜5. ダウンロード・背景画像・スコア・エイリアスを依存関係に沿って並行に実行する
+            # (背景はジャケットだけ、スコアとエイリアスは譜面の情報と列だけを待つ)
+            # 前回の生成内容は manifest.json に記録し、入力が変わっていないステージは省略する
+            pipeline = self._build_pipeline(prefix, id_part, full_level_id, dist_dir)
+            manifest = Manifest(os.path.join(dist_dir, MANIFEST_FILENAME))
+            dry_run = self.config.get('dry_run', False)
+            # 各ステージの時間・CPU・メモリ・バイト数を記録する (profile に指定したステージは cProfile でも計測する)
+            tracer = tracing.Tracer(self.config.get('profile', ()), os.path.join(dist_dir, PROFILE_DIRNAME))
+            try:
+                with tracing.activate(tracer), contextlib.ExitStack() as network_slot:
+                    # ダウンロード中だけ枠を確保し、3つのファイルが揃ったら描画や計算を待たずに解放する
+                    network_slot.enter_context(self.network_slots or contextlib.nullcontext())
+                    pipeline.run({"network_slot": network_slot}, manifest=manifest,
+                                 force=self.config.get('force_rebuild', False), dry_run=dry_run)
+            finally:
+                self._report_trace(full_level_id, dist_dir, tracer)
+            print(f"[{full_level_id}] {pipeline.plan_text()}")
+
+            # ドライランは計画を表示するだけで、dist/<id> の中身 (前回残した level.json なども) は変えない
+            if dry_run:
+                rebuilt = [name for name, action in pipeline.plan.items() if action == "再生成"]
+                self.update_status(f"[{full_level_id}] 再生成するステージ: {', '.join(rebuilt) or 'なし'}")
+                return True, f"譜面 '{full_level_id}' の再生成が必要なステージ: {', '.join(rebuilt) or 'なし'}"
+
+            # 6. クリーンアップ (★ dist_dirを使う)
+            self._cleanup(dist_dir)
+
+            if self.config.get('open_output_folder', True):
+                self.update_status("出力フォルダを開いています...")
+                self._open_output_folder(dist_dir)
+            
+            self.update_status("すべての処理が正常に完了しました。")
+            return True, f"譜面 '{full_level_id}' のファイル生成が完了しました。"
+
+        except Exception as e:
+            self.update_status(f"エラー: {e}")
+            return False, f"処理中にエラーが発生しました:\n{e}"
+
+    def _build_pipeline(self, prefix: str, id_part: str, full_level_id: str, dist_dir: str) -> Pipeline:
+        """生成処理をステージの依存グラフとして組み立てる"""
+        # 各モジュール (requests・numpy・OpenCV など) は実行時に初めて読み込む。
+        # image_processor は描画の準備をするステージの中で、ダウンロードと並行して読み込む
+        from src.modules import downloader, score_calculator, alias_writer, cache_store
+        from src.modules.http_cache import HttpCache
+        from src.modules.transfer import TransferProgress
+        from src.modules.chart_columns import load_saved_chart_columns
+        from src.modules.background_variant import BASE_RESOLUTION, BackgroundVariant
+
+        http_cache = None
+        if self.config.get('http_cache', True):
+            # キャッシュのフォルダを作れない場合は、キャッシュを使わずにダウンロードする
+            http_cache = HttpCache.open(os.path.join(config.CACHE_DIR, "http"), config.HTTP_CACHE_MAX_BYTES)
+        progress = TransferProgress(lambda message: self.update_status(f"[{full_level_id}] {message}"))
+        keep_chart_file = self.config.get('keep_chart_file', False)
+
+        background_cache_dir = None
+        if self.config.get('background_disk_cache', False):
+            background_cache_dir = os.path.join(config.CACHE_DIR, "background")
+        render_cache = None
+        if self.config.get('background_render_cache', True):
+            render_cache = cache_store.open_cache(
+                os.path.join(config.CACHE_DIR, "renders"), config.RENDER_CACHE_MAX_BYTES, suffix=".png"
+            )
+        # ドラフトでは background.png とアセットを縮小し、エイリアスとスコアオブジェクトの拡大率で補正する
+        # (ドラフトを外して生成し直すと、縮小したものは全て元の品質で作り直される)
+        draft = self.config.get('draft', False)
+        draft_scale = float(self.config.get('draft_scale', config.DRAFT_SCALE)) if draft else 1.0
+        background_resolution = (round(BASE_RESOLUTION[0] * draft_scale), round(BASE_RESOLUTION[1] * draft_scale))
+
+        # background.png とは別に出力する背景画像 (バージョンと解像度の組)。background.png と一緒に生成する
+        background_variants = [BackgroundVariant.parse(v) for v in self.config.get('background_variants', [])]
+        background_outputs = [BackgroundVariant(self.config['bg_version'], background_resolution,
+                                                filename="background.png")] + background_variants
+        background_versions = list(dict.fromkeys(v.version for v in background_outputs))
+        skobj_format = self.config.get('skobj_format', 'json')
+        skobj_filename = score_calculator.get_skobj_filename(skobj_format)
+        # compact / lua は列形式を読めるスクリプトが必要 (古いスクリプトは Lua のエラーで止まる)
+        if skobj_format != "json" and config.get_installed_script_version() != config.APP_VERSION:
+            raise ValueError(f"出力形式 '{skobj_format}' を使うには、先に GUI を起動して @SekaiObjects.obj2 を"
+                             f"バージョン {config.APP_VERSION} に更新してください (それまでは json を使ってください)。")
+        assets_path = os.path.abspath(resource_path('assets'))
+        chart_columns_path = os.path.join(dist_dir, CHART_COLUMNS_FILENAME)
+
+        def fetch_level():
             self.update_status(f"[{full_level_id}] データをダウンロード中...")
-            downloader.download_and_prepare_assets(prefix, id_part, dist_dir)
+            level = downloader.fetch_level(prefix, id_part, dist_dir)
+            if self.config.get('debug_dump', False):
+                level.dump()
+            return level, level.cover_url, level.bgm_url, level.chart_url
 
-            # 3. 背景画像生成 (★ dist_dirを渡す)
+        def load_renderer():
+            from src.modules import image_processor
+            return ":".join(image_processor.render_fingerprint(version) for version in background_versions)
+
+        def render_background(jacket, renderer):
+            from src.modules import image_processor
             self.update_status("背景画像を生成中...")
-            image_processor.generate_background_image(full_level_id, self.config['bg_version'], dist_dir)
+            image_processor.generate_background_variants(
+                full_level_id, background_outputs, dist_dir, cache_dir=background_cache_dir,
+                render_cache=render_cache, status_callback=self.update_status, jacket=jacket
+            )
 
-            # 4. スコアオブジェクト生成 (★ dist_dirを渡す)
+        def prepare_draft_assets():
+            from src.modules import draft_assets
+            self.update_status("ドラフト用のアセットを準備中...")
+            return draft_assets.build_draft_assets(os.path.join(config.CACHE_DIR, "draft_assets"), draft_scale)
+
+        def calculate_score(level, chart, assets_dir=None):
             self.update_status("スコアオブジェクトを生成中...")
-            last_note_time = score_calculator.generate_skobj_data(
-                full_level_id, dist_dir, self.config['team_power'], config.APP_VERSION
+            level.chart = chart
+            return score_calculator.generate_skobj_data(
+                level, self.config['team_power'], config.APP_VERSION, output_format=skobj_format,
+                assets_dir=assets_dir, asset_scale=draft_scale
             )
 
-            # 5. エイリアスオブジェクト生成 (★ dist_dirを渡す)
+        def write_alias(level, last_note_time, assets_dir=None):
             self.update_status("エイリアスオブジェクトを生成中...")
             alias_writer.generate_alias_object(
-                full_level_id, dist_dir, last_note_time, self.config['extra_data']
+                level, last_note_time, self.config['extra_data'], skobj_filename=skobj_filename,
+                assets_dir=assets_dir, image_scale=draft_scale
             )
 
-            # 6. クリーンアップ (★ dist_dirを使う)
-            self._cleanup(dist_dir)
+        def load_jacket(filename):
+            from PIL import Image
+            with Image.open(os.path.join(dist_dir, filename)) as jacket:
+                jacket.load()
+                return jacket
 
-            self.update_status("出力フォルダを開いています...")
-            self._open_output_folder(dist_dir)
-            
-            self.update_status("すべての処理が正常に完了しました。")
-            return True, f"譜面 '{full_level_id}' のファイル生成が完了しました。"
+        def save_chart(chart):
+            # 譜面の列は .npz に保存しておき、ステージを省略したときはそこから読み込む
+            chart.save(chart_columns_path)
+            return CHART_COLUMNS_FILENAME
 
-        except Exception as e:
-            self.update_status(f"エラー: {e}")
-            return False, f"処理中にエラーが発生しました:\n{e}"
+        def load_chart(filename):
+            return load_saved_chart_columns(os.path.join(dist_dir, filename))
+
+        chart_files = [os.path.join(dist_dir, "chart.json")] if keep_chart_file else []
+        background_params = {"version": self.config['bg_version']}
+        if background_variants:
+            background_params["variants"] = [str(v) for v in background_variants]
+        background_files = [os.path.join(dist_dir, v.filename) for v in background_outputs]
+        score_params = {"team_power": self.config['team_power'], "format": skobj_format,
+                        "app_version": config.APP_VERSION, "index_fps": config.SKOBJ_INDEX_FPS,
+                        "assets": assets_path}
+        alias_params = {"extra_data": self.config['extra_data'], "skobj_filename": skobj_filename,
+                        "app_version": config.APP_VERSION, "assets": assets_path,
+                        "dist_dir": os.path.abspath(dist_dir)}
+        # ドラフトではスコアとエイリアスが縮小したアセットのフォルダ (assets_dir) を待つ
+        draft_stages = []
+        draft_inputs = []
+        if draft:
+            for params in (background_params, score_params, alias_params):
+                params["draft_scale"] = draft_scale
+            draft_stages.append(Stage("draft_assets", prepare_draft_assets, outputs=["assets_dir"]))
+            draft_inputs.append("assets_dir")
+
+        return Pipeline(draft_stages + [
+            Stage("level", fetch_level, outputs=["level", "cover_url", "bgm_url", "chart_url"]),
+            Stage("jacket", lambda url: downloader.prepare_jacket(url, dist_dir, http_cache, progress),
+                  inputs=["cover_url"], outputs=["jacket"], params={},
+                  files=[os.path.join(dist_dir, "jacket.jpg")], save=lambda jacket: "jacket.jpg", load=load_jacket),
+            Stage("bgm", lambda url: downloader.download_bgm(url, dist_dir, http_cache, progress),
+                  inputs=["bgm_url"], outputs=["bgm"], params={},
+                  files=[os.path.join(dist_dir, "music.mp3")]),
+            Stage("chart", lambda url: downloader.prepare_chart(url, dist_dir, keep_chart_file, http_cache, progress),
+                  inputs=["chart_url"], outputs=["chart"], params={"keep_chart_file": keep_chart_file},
+                  files=[chart_columns_path] + chart_files, save=save_chart, load=load_chart),
+            Stage("downloaded", lambda network_slot, *files: network_slot.close(),
+                  inputs=["network_slot", "jacket", "bgm", "chart"]),
+            Stage("renderer", load_renderer, outputs=["renderer"]),
+            Stage("background", render_background, inputs=["jacket", "renderer"],
+                  params=background_params, files=background_files),
+            Stage("score", calculate_score, inputs=["level", "chart"] + draft_inputs, outputs=["last_note_time"],
+                  params=score_params, files=[os.path.join(dist_dir, skobj_filename)]),
+            Stage("alias", write_alias, inputs=["level", "last_note_time"] + draft_inputs,
+                  params=alias_params, files=[os.path.join(dist_dir, "main.object")]),
+        ])
+
+    def _report_trace(self, full_level_id: str, dist_dir: str, tracer: tracing.Tracer):
+        """計測結果の要約を表示し、設定に応じて Chrome 形式のトレースを保存する"""
+        print(f"[{full_level_id}] {tracer.summary()}")
+        if self.config.get('trace', False):
+            trace_path = os.path.join(dist_dir, TRACE_FILENAME)
+            tracer.write_chrome_trace(trace_path)
+            print(f"[{full_level_id}] トレースを '{trace_path}' に保存しました。")
+        for path in tracer.profile_paths:
+            print(f"[{full_level_id}] プロファイルを '{path}' に保存しました。")
 
     def _cleanup(self, dist_dir: str):
+        from src.modules.level_context import LEVEL_DUMP_FILENAME
         self.update_status("一時ファイルをクリーンアップ中...")
-        for filename in ["level.json", "chart.json"]:
+        filenames = []
+        if not self.config.get('debug_dump', False):
+            filenames.append(LEVEL_DUMP_FILENAME)
+        if not self.config.get('keep_chart_file', False):
+            filenames.append("chart.json")
+        for filename in filenames:
             path = os.path.join(dist_dir, filename)
             if os.path.exists(path):
                 os.remove(path)
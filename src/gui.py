@@ -1,21 +1,25 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import threading
-import requests
 from src import config
 import webbrowser
-from src.generator import Generator
-from src.modules import setup_handler
 
 class Application(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title(f"Sekai Overlay Generator v{config.APP_VERSION}")
-        setup_handler.check_and_run_setup()
         self.geometry("500x680")
         self.resizable(False, False)
         self._setup_styles()
         self._create_widgets()
+        # セットアップと更新確認は、ウィンドウを表示してから行う
+        self.after_idle(self._after_startup)
+
+    def _after_startup(self):
+        self.update_idletasks()
+        # 重いモジュール (requests など) は必要になってから読み込む
+        from src.modules import setup_handler
+        setup_handler.check_and_run_setup()
         threading.Thread(target=self._check_for_updates, daemon=True).start()
 
     def _setup_styles(self):
@@ -93,6 +97,10 @@ class Application(tk.Tk):
         ttk.Radiobutton(bg_radio_frame, text="v3", variable=self.bg_version_var, value="3").pack(side="left", padx=5)
         ttk.Radiobutton(bg_radio_frame, text="v1", variable=self.bg_version_var, value="1").pack(side="left", padx=5)
 
+        # ドラフトは背景画像とアセットを縮小して編集を軽くする (外して生成し直すと元の品質に戻る)
+        self.draft_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(parent, text="ドラフト (低解像度のプレビュー用)", variable=self.draft_var).grid(row=4, column=1, sticky="w", pady=5)
+
     def _start_generation(self):
         self.run_button.config(state="disabled")
         
@@ -100,6 +108,7 @@ class Application(tk.Tk):
             "full_level_id": self.full_level_id_var.get().strip(),
             "bg_version": self.bg_version_var.get(),
             "team_power": float(self.team_power_var.get()),
+            "draft": self.draft_var.get(),
             "app_version": config.APP_VERSION,
             "extra_data": {key: var.get() for key, var in self.meta_vars.items()}
         }
@@ -111,6 +120,7 @@ class Application(tk.Tk):
     def _check_for_updates(self):
         """起動時に新しいバージョンがないか確認する"""
         try:
+            import requests
             response = requests.get(config.UPDATE_CHECK_URL, timeout=10)
             response.raise_for_status()
             remote_data = response.json()
@@ -128,6 +138,7 @@ class Application(tk.Tk):
             print(f"アップデートチェックに失敗しました: {e}")
 
     def _run_generator(self, config):
+        from src.generator import Generator
         generator = Generator(config, lambda msg: self.status_var.set(msg))
         success, message = generator.run()
         
@@ -1,34 +1,125 @@
 # alias_gen.py
 
 import os
-import json
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
 from src.utils import resource_path
+from src import tracing
+from src.modules.level_context import LevelContext
 
+# テンプレート中の {名前} を置き換える名前
+PLACEHOLDERS = (
+    "title", "author", "words", "music", "arrange", "vocal", "difficulty", "difficulty_img",
+    "distPath", "assetsPath", "skobjFile",
+    "videoStartFrame", "fadeStartFrame", "fadeStopFrame", "endFrame",
+)
 
-def generate_alias_object(level_id: str, dist_dir: str, last_note_time: float, extra_data: dict) -> str: # ★ base_dir引数を削除
+# ドラフトで縮小した画像を表示するオブジェクト (画像ファイルの拡張子で判定する。jacket.jpg は縮小しない)
+DRAFT_IMAGE_EXTENSIONS = (".png",)
+
+# 読み込んで分解したテンプレート ((パス, 画像の倍率) ごと、プロセス内で共有する)
+_template_cache: Dict[Tuple[str, float], "CompiledTemplate"] = {}
+_template_cache_lock = threading.Lock()
+
+
+class CompiledTemplate:
+    """
+    テンプレートを固定の文字列とプレースホルダーの並びに分解したもの。
+    render はプレースホルダーに値を1回ずつ入れて結合するだけなので、値の中の {名前} は置き換えない。
+    """
+    def __init__(self, text: str, names: Tuple[str, ...] = PLACEHOLDERS):
+        pattern = re.compile("|".join(re.escape("{" + name + "}") for name in names))
+        self.parts: List[str] = []
+        self.slots: List[Tuple[int, str]] = []
+        position = 0
+        for match in pattern.finditer(text):
+            self.parts.append(text[position:match.start()])
+            self.slots.append((len(self.parts), match.group()[1:-1]))
+            self.parts.append("")
+            position = match.end()
+        self.parts.append(text[position:])
+
+    def render(self, values: Dict[str, str]) -> str:
+        parts = self.parts.copy()
+        for index, name in self.slots:
+            parts[index] = values[name]
+        return "".join(parts)
+
+
+def _compensate_image_zoom(text: str, image_scale: float) -> str:
+    """
+    縮小した画像 (DRAFT_IMAGE_EXTENSIONS) を表示するオブジェクトの標準描画の拡大率を 1 / image_scale 倍にする。
+    オブジェクトは [番号] の行から次の [番号] の行まで、その中の効果は [番号.番号] の行から始まる。
+    """
+    lines = text.split("\n")
+    scaled_objects = set()
+    current_object = effect = None
+    for line in lines:
+        if line.startswith("[") and line.endswith("]"):
+            current_object, effect = line[1:-1].split(".")[0], None
+        elif line.startswith("effect.name="):
+            effect = line[len("effect.name="):]
+        elif effect == "画像ファイル" and line.startswith("ファイル=") and line.lower().endswith(DRAFT_IMAGE_EXTENSIONS):
+            scaled_objects.add(current_object)
+
+    current_object = effect = None
+    for i, line in enumerate(lines):
+        if line.startswith("[") and line.endswith("]"):
+            current_object, effect = line[1:-1].split(".")[0], None
+        elif line.startswith("effect.name="):
+            effect = line[len("effect.name="):]
+        elif effect == "標準描画" and current_object in scaled_objects and line.startswith("拡大率="):
+            lines[i] = f"拡大率={float(line[len('拡大率='):]) / image_scale:.3f}"
+    return "\n".join(lines)
+
+
+def load_template(template_path: str, image_scale: float = 1.0) -> CompiledTemplate:
+    """
+    テンプレートを読み込んで分解する (同じパスと倍率は2回目からキャッシュを返す)。
+    image_scale が 1 以外なら、縮小した画像に合わせて拡大率を補正する。
+    """
+    key = (template_path, image_scale)
+    with _template_cache_lock:
+        template = _template_cache.get(key)
+    if template is None:
+        with open(template_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        if image_scale != 1:
+            text = _compensate_image_zoom(text, image_scale)
+        template = CompiledTemplate(text)
+        with _template_cache_lock:
+            _template_cache[key] = template
+    return template
+
+
+def generate_alias_object(context: LevelContext, last_note_time: float, extra_data: dict,
+                          skobj_filename: str = "skobj_data.json", assets_dir: Optional[str] = None,
+                          image_scale: float = 1.0) -> str: # ★ base_dir引数を削除
+    """
+    main.object を書き出し、タイトルを返す。
+    ドラフトでは assets_dir に縮小したアセットのフォルダ、image_scale にその倍率を指定する
+    (background.png も同じ倍率で縮小してあること)。
+    """
     print("エイリアスオブジェクトの生成を開始します...")
-    
+
     # ★ プロジェクトルートを基準にパスを再構築
-    assets_dir = resource_path('assets')
-    
+    assets_dir = assets_dir or resource_path('assets')
+
     try:
         # ★ template_pathをresource_pathで取得
         template_path = resource_path(os.path.join('assets', 'alias', 'template.object'))
-        level_json_path = os.path.join(dist_dir, 'level.json')
-        output_path = os.path.join(dist_dir, 'main.object')
+        output_path = os.path.join(context.dist_dir, 'main.object')
+
+        # 2. テンプレートの読み込み (プロセス内で1回だけ)
+        template = load_template(template_path, image_scale)
 
-        # 2. ファイル読み込み
-        with open(template_path, 'r', encoding='utf-8') as f:
-            template_content = f.read()
-        with open(level_json_path, 'r', encoding='utf-8') as f:
-            level_data = json.load(f)
-        
         # 3. プレースホルダー用の値を取得
-        item_data = level_data.get('item', {})
-        
+        item_data = context.item
+
         final_title = extra_data.get('title') or item_data.get('title') or '-'
         final_author = extra_data.get('author') or item_data.get('author') or '-'
-        
+
         difficulty_input = extra_data.get('difficulty', 'custom')
         standard_difficulties = ["easy", "normal", "hard", "expert", "master", "append"]
         difficulty_img_val = difficulty_input.lower() if difficulty_input.lower() in standard_difficulties else 'custom'
@@ -36,29 +127,30 @@ def generate_alias_object(level_id: str, dist_dir: str, last_note_time: float, e
         vocal_text = f"Vo. {vocal_input}" if vocal_input else "Inst. ver."
 
         replacements = {
-            '{title}': final_title,
-            '{author}': final_author,
-            '{words}': extra_data.get('words', '-'),
-            '{music}': extra_data.get('music', '-'),
-            '{arrange}': extra_data.get('arrange', '-'),
-            '{vocal}': vocal_text,
-            '{difficulty}': difficulty_input.upper(),
-            '{difficulty_img}': difficulty_img_val
+            'title': final_title,
+            'author': final_author,
+            'words': extra_data.get('words', '-'),
+            'music': extra_data.get('music', '-'),
+            'arrange': extra_data.get('arrange', '-'),
+            'vocal': vocal_text,
+            'difficulty': difficulty_input.upper(),
+            'difficulty_img': difficulty_img_val
         }
-        
+
         # 空白だった場合のデフォルト値を設定
         for key, value in replacements.items():
             if not value:
-                if key == '{vocal}':
+                if key == 'vocal':
                     replacements[key] = 'Inst. ver.'
                 else:
                     replacements[key] = '-'
 
         # パス情報
-        dist_full_path = os.path.abspath(dist_dir).replace(os.sep, '\\')
+        dist_full_path = os.path.abspath(context.dist_dir).replace(os.sep, '\\')
         assets_full_path = os.path.abspath(assets_dir).replace(os.sep, '\\')
-        replacements['{distPath}'] = dist_full_path
-        replacements['{assetsPath}'] = assets_full_path
+        replacements['distPath'] = dist_full_path
+        replacements['assetsPath'] = assets_full_path
+        replacements['skobjFile'] = skobj_filename
 
         # 4. 新しいフレーム計算ロジック
         video_start_frame = round((last_note_time + 1.0) * 60) + 316
@@ -66,24 +158,23 @@ def generate_alias_object(level_id: str, dist_dir: str, last_note_time: float, e
         fade_stop_frame = fade_start_frame + 142
         end_frame = fade_stop_frame + 124
 
-        replacements['{videoStartFrame}'] = str(video_start_frame)
-        replacements['{fadeStartFrame}'] = str(fade_start_frame)
-        replacements['{fadeStopFrame}'] = str(fade_stop_frame)
-        replacements['{endFrame}'] = str(end_frame)
-        
-        # 5. 文字列を一括置換
-        output_content = template_content
-        for placeholder, value in replacements.items():
-            output_content = output_content.replace(placeholder, value)
+        replacements['videoStartFrame'] = str(video_start_frame)
+        replacements['fadeStartFrame'] = str(fade_start_frame)
+        replacements['fadeStopFrame'] = str(fade_stop_frame)
+        replacements['endFrame'] = str(end_frame)
+
+        # 5. 分解済みのテンプレートに値を1回ずつ入れる
+        output_content = template.render(replacements)
 
         # 6. 結果を書き出し
-        with open(output_path, 'w', encoding='utf-8') as f:
+        with tracing.span("alias_write"), open(output_path, 'w', encoding='utf-8') as f:
             f.write(output_content)
-        
+            tracing.add_bytes("written", f.tell())
+
         print(f"エイリアスオブジェクトを '{output_path}' に保存しました。")
         return final_title
 
     except FileNotFoundError as e:
         raise FileNotFoundError(f"必要なファイルが見つかりませんでした: {e.filename}")
     except Exception as e:
-        raise RuntimeError(f"エイリアスオブジェクトの生成中にエラーが発生しました: {e}")
\ No newline at end of file
+        raise RuntimeError(f"エイリアスオブジェクトの生成中にエラーが発生しました: {e}")
@@ -0,0 +1,57 @@
+from typing import Optional, Tuple
+
+# 背景画像のテンプレートが想定している動画の解像度 (この解像度ではテンプレートと同じ大きさで出力する)
+BASE_RESOLUTION = (1920, 1080)
+
+# 対応している背景バージョン (image_processor.LAYER_STACKS のキー)
+BACKGROUND_VERSIONS = ("3", "1")
+
+
+class BackgroundVariant:
+    """
+    背景画像の出力1つ分 (背景バージョンと動画の解像度)。
+    画像は BASE_RESOLUTION に対する解像度の倍率でテンプレートの大きさを拡大・縮小して出力する
+    (エイリアスの拡大率はそのままで、同じ倍率のプロジェクトで同じ見た目になる)。
+    文字列では "3@3840x2160" のように書く (解像度を省略すると BASE_RESOLUTION)。
+    filename を省略すると、バージョンと解像度からファイル名を決める。
+    """
+    def __init__(self, version: str, resolution: Tuple[int, int] = BASE_RESOLUTION, filename: Optional[str] = None):
+        if version not in BACKGROUND_VERSIONS:
+            raise ValueError(f"バージョン '{version}' は現在サポートされていません。")
+        width, height = int(resolution[0]), int(resolution[1])
+        if width <= 0 or height <= 0:
+            raise ValueError(f"解像度が不正です: {width}x{height}")
+        self.version = version
+        self.resolution = (width, height)
+        self.filename = filename or f"background_v{version}_{width}x{height}.png"
+
+    @classmethod
+    def parse(cls, text: str) -> "BackgroundVariant":
+        version, _, resolution = str(text).strip().partition("@")
+        if not resolution:
+            return cls(version)
+        width, _, height = resolution.lower().partition("x")
+        if not (width.isdigit() and height.isdigit()):
+            raise ValueError(f"背景画像の指定が不正です (例: 3@3840x2160): {text}")
+        return cls(version, (int(width), int(height)))
+
+    @property
+    def scale(self) -> float:
+        """テンプレートの大きさに対する倍率 (縦横比が違う場合は大きい方に合わせる)"""
+        return max(self.resolution[0] / BASE_RESOLUTION[0], self.resolution[1] / BASE_RESOLUTION[1])
+
+    def canvas_size(self, template_size: Tuple[int, int]) -> Tuple[int, int]:
+        """テンプレートの大きさから出力する画像の大きさを求める"""
+        return (max(1, round(template_size[0] * self.scale)), max(1, round(template_size[1] * self.scale)))
+
+    def __str__(self) -> str:
+        return f"{self.version}@{self.resolution[0]}x{self.resolution[1]}"
+
+    def __repr__(self) -> str:
+        return f"BackgroundVariant({self})"
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, BackgroundVariant) and (str(self), self.filename) == (str(other), other.filename)
+
+    def __hash__(self) -> int:
+        return hash((str(self), self.filename))
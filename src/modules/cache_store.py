@@ -0,0 +1,137 @@
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional, Tuple
+
+_TEMP_SUFFIX = ".tmp"
+
+
+def link_or_copy(src_path: str, dest_path: str) -> None:
+    """
+    src_path を dest_path にハードリンクする。リンクできない場合 (別ドライブなど) はコピーする。
+    既存の dest_path は先に削除するため、dest_path 側を上書き保存してもリンク元は書き換わらない。
+    """
+    if os.path.lexists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(src_path, dest_path)
+    except OSError:
+        shutil.copyfile(src_path, dest_path)
+
+
+class ContentCache:
+    """
+    キー (内容のハッシュなど) からファイルを引くディスクキャッシュ。
+    エントリは root/<キーの先頭2文字>/<キー><suffix> に保存し、合計サイズが max_bytes を超えたら
+    最後に使われた日時 (更新日時) が古いものから削除する。
+    """
+    def __init__(self, root: str, max_bytes: int, suffix: str = ""):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + self.suffix)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """キャッシュにあればそのパスを返し、最後に使われた日時 (更新日時) を進める。なければ None"""
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def fetch(self, key: str, dest_path: str) -> bool:
+        """キャッシュにあれば dest_path にリンク (またはコピー) して True を返す"""
+        path = self.lookup(key)
+        if path is None:
+            return False
+        try:
+            link_or_copy(path, dest_path)
+        except OSError:
+            return False
+        return True
+
+    def temp_path(self, key: str) -> str:
+        """エントリと同じディレクトリに作る一時ファイルのパス (store(move=True) に渡すファイルの書き込み先)"""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}.{threading.get_ident()}{_TEMP_SUFFIX}"
+
+    def store(self, key: str, src_path: str, move: bool = False) -> Optional[str]:
+        """
+        src_path の内容をキャッシュに保存し、保存先のパスを返す。保存できなくても処理は続ける (None を返す)。
+        move が True の場合は src_path をそのまま移動する (同じドライブ上のファイルであること)。
+        """
+        path = self.path_for(key)
+        temp_path = src_path if move else None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if not move:
+                temp_path = self.temp_path(key)
+                # 出力先のファイルが後から書き換えられてもよいように、リンクではなくコピーを保存する
+                shutil.copyfile(src_path, temp_path)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"キャッシュを保存できませんでした: {e}")
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        # 保存したばかりのエントリは、上限より大きくても呼び出し側が使い終わるまで残す
+        self.evict(keep=path)
+        return path
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(_TEMP_SUFFIX):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """合計サイズが max_bytes 以下になるまで、古いエントリから削除する (keep のパスは削除しない)"""
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+    def stats_text(self) -> str:
+        return f"キャッシュ ヒット {self.hits} / ミス {self.misses}"
+
+
+# 同じディレクトリのキャッシュはプロセス内で1つのインスタンスを使い回し、ヒット数を通算する
+_caches: Dict[str, ContentCache] = {}
+_caches_lock = threading.Lock()
+
+
+def open_cache(root: str, max_bytes: int, suffix: str = "") -> ContentCache:
+    with _caches_lock:
+        cache = _caches.get(root)
+        if cache is None:
+            cache = _caches[root] = ContentCache(root, max_bytes, suffix)
+        cache.max_bytes = max_bytes
+    return cache
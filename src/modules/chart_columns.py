@@ -0,0 +1,271 @@
+from array import array
+import codecs
+import hashlib
+import json
+import os
+import re
+import zlib
+from typing import Any, BinaryIO, Dict, Iterable, Iterator, List, Tuple
+import numpy as np
+from src.config import WEIGHT_MAP
+from src import tracing
+
+BPM_CHANGE_ARCHETYPE = "#BPM_CHANGE"
+CHUNK_SIZE = 64 * 1024
+
+# (archetype, #BEAT, #BPM, data の有無)
+EntityFields = Tuple[str, float, float, bool]
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_DECODER = json.JSONDecoder()
+_DELIMITERS = frozenset(' \t\n\r,:]}')
+
+
+class ChartColumns:
+    """
+    chart.json のエンティティを、エンティティ順に並んだ列(配列)として保持する。
+    archetype は archetypes のインデックスとして保持し、重みの参照は種類ごとに1回で済ませる。
+    """
+    def __init__(self, archetypes: List[str], archetype_ids: np.ndarray, beats: np.ndarray,
+                 bpms: np.ndarray, has_data: np.ndarray, total_weight: float):
+        self.archetypes = archetypes
+        self.archetype_ids = archetype_ids
+        self.beats = beats
+        self.bpms = bpms
+        self.has_data = has_data
+        # WEIGHT_MAP に基づく全エンティティの重みの合計 (重み付きノート数)
+        self.total_weight = total_weight
+
+        weight_table = np.array([WEIGHT_MAP.get(a, 0.0) for a in archetypes], dtype=np.float64)
+        self.weights = weight_table[archetype_ids] if len(archetypes) else np.zeros(0)
+
+        bpm_id = archetypes.index(BPM_CHANGE_ARCHETYPE) if BPM_CHANGE_ARCHETYPE in archetypes else -1
+        is_bpm_archetype = archetype_ids == bpm_id
+        self.is_bpm = is_bpm_archetype & has_data & (bpms > 0)
+        self.is_note = ~is_bpm_archetype & has_data & (self.weights > 0.0)
+
+    def __len__(self) -> int:
+        return len(self.archetype_ids)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self.archetype_ids, self.beats, self.bpms, self.has_data,
+                                      self.weights, self.is_bpm, self.is_note))
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "archetypes": np.array(self.archetypes, dtype=str),
+            "archetype_ids": self.archetype_ids,
+            "beats": self.beats,
+            "bpms": self.bpms,
+            "has_data": self.has_data,
+            "total_weight": np.array(self.total_weight, dtype=np.float64),
+        }
+
+    def fingerprint(self) -> str:
+        """列の内容から指紋 (SHA-256) を作る"""
+        digest = hashlib.sha256()
+        for name, values in self._arrays().items():
+            digest.update(name.encode())
+            digest.update(np.ascontiguousarray(values).tobytes())
+        return digest.hexdigest()
+
+    def save(self, path: str):
+        """列を .npz 形式で保存する (load_saved_chart_columns で読み込める)"""
+        with open(path, 'wb') as f:
+            np.savez(f, **self._arrays())
+            tracing.add_bytes("written", f.tell())
+
+
+def _get_entity_fields(entity: Dict[str, Any]) -> EntityFields:
+    """エンティティからスコア計算に必要な値 (archetype, #BEAT, #BPM, data の有無) だけを取り出す"""
+    # 同名の値が複数ある場合は最初のものを使う (_get_value_from_data と同じ)
+    beat = bpm = None
+    data = entity.get("data")
+    if data:
+        for item in data:
+            name = item.get("name")
+            if name == "#BEAT" and beat is None:
+                beat = float(item.get("value", 0.0))
+            elif name == "#BPM" and bpm is None:
+                bpm = float(item.get("value", 0.0))
+
+    return (
+        entity.get("archetype", ""),
+        beat if beat is not None else 0.0,
+        bpm if bpm is not None else 0.0,
+        bool(data),
+    )
+
+
+def build_chart_columns_from_fields(rows: Iterable[EntityFields]) -> ChartColumns:
+    """_get_entity_fields の結果を1回だけ走査して ChartColumns を構築する"""
+    archetype_index: Dict[str, int] = {}
+    archetypes: List[str] = []
+    archetype_ids = array('i')
+    beats = array('d')
+    bpms = array('d')
+    has_data = array('b')
+
+    for archetype, beat, bpm, entity_has_data in rows:
+        archetype_id = archetype_index.get(archetype)
+        if archetype_id is None:
+            archetype_id = archetype_index[archetype] = len(archetypes)
+            archetypes.append(archetype)
+
+        archetype_ids.append(archetype_id)
+        beats.append(beat)
+        bpms.append(bpm)
+        has_data.append(entity_has_data)
+
+    ids = np.frombuffer(archetype_ids, dtype=np.intc).astype(np.int32)
+    # 合計は従来と同じく Python の sum でエンティティ順に足し込む
+    raw_weights = [WEIGHT_MAP.get(a, 0.0) for a in archetypes]
+    total_weight = sum(map(raw_weights.__getitem__, archetype_ids))
+
+    return ChartColumns(
+        archetypes,
+        ids,
+        np.frombuffer(beats, dtype=np.float64).copy(),
+        np.frombuffer(bpms, dtype=np.float64).copy(),
+        np.frombuffer(has_data, dtype=np.int8).astype(bool),
+        total_weight,
+    )
+
+
+def build_chart_columns(entities: Iterable[Dict[str, Any]]) -> ChartColumns:
+    """エンティティのリストから ChartColumns を構築する"""
+    return build_chart_columns_from_fields(map(_get_entity_fields, entities))
+
+
+class _ChunkReader:
+    """バイト列のチャンクを UTF-8 文字列のバッファとして少しずつ読み進める"""
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """次のチャンクをバッファに追加する。これ以上データがなければ False を返す"""
+        if self.eof:
+            return False
+        # 読み終えた部分は捨ててバッファが大きくならないようにする
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk)
+            if text:
+                self.buf += text
+                return True
+        self.buf += self._decoder.decode(b"", final=True)
+        self.eof = True
+        return True
+
+    def skip_whitespace(self) -> str:
+        """空白を読み飛ばし、次の1文字を返す (終端なら空文字)"""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char: str):
+        if self.skip_whitespace() != char:
+            raise ValueError(f"chart.json の形式が不正です ('{char}' が必要な位置: {self.pos})")
+        self.pos += 1
+
+    def decode_value(self) -> Any:
+        """バッファ先頭の JSON 値を1つ取り出す。値が途中で切れていれば続きを読み込む"""
+        self.skip_whitespace()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+                # 数値がチャンクの境界で切れている可能性があるので、値の直後が区切り文字であることを確認する
+                if self.eof or (end < len(self.buf) and self.buf[end] in _DELIMITERS):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def iter_chart_entity_fields(chunks: Iterable[bytes]) -> Iterator[EntityFields]:
+    """
+    chart.json のバイト列をチャンクごとに受け取り、entities の要素を1つずつ解析して
+    スコア計算に必要な値だけを返す。譜面全体を文字列やオブジェクトとして保持しない。
+    """
+    reader = _ChunkReader(chunks)
+    reader.expect("{")
+    if reader.skip_whitespace() == "}":
+        return
+
+    while True:
+        key = reader.decode_value()
+        reader.expect(":")
+        if key == "entities":
+            reader.expect("[")
+            if reader.skip_whitespace() == "]":
+                reader.pos += 1
+            else:
+                while True:
+                    yield _get_entity_fields(reader.decode_value())
+                    char = reader.skip_whitespace()
+                    reader.pos += 1
+                    if char == "]":
+                        break
+                    if char != ",":
+                        raise ValueError(f"chart.json の形式が不正です (entities の位置: {reader.pos})")
+        else:
+            reader.decode_value()
+
+        char = reader.skip_whitespace()
+        reader.pos += 1
+        if char == "}":
+            return
+        if char != ",":
+            raise ValueError(f"chart.json の形式が不正です (位置: {reader.pos})")
+
+
+def iter_gunzip(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """gzip 圧縮されたバイト列のチャンクを、展開しながら順に返す"""
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    data = decompressor.flush()
+    if data:
+        yield data
+
+
+def _iter_file_chunks(f: BinaryIO) -> Iterator[bytes]:
+    return iter(lambda: f.read(CHUNK_SIZE), b"")
+
+
+def load_chart_columns(chart_path: str) -> ChartColumns:
+    """chart.json (または chart.json.gz) を少しずつ読み込んで ChartColumns を構築する"""
+    tracing.add_bytes("read", os.path.getsize(chart_path))
+    with open(chart_path, 'rb') as f:
+        chunks = _iter_file_chunks(f)
+        if chart_path.endswith(".gz"):
+            chunks = iter_gunzip(chunks)
+        return build_chart_columns_from_fields(iter_chart_entity_fields(chunks))
+
+
+def load_saved_chart_columns(path: str) -> ChartColumns:
+    """ChartColumns.save で保存した列を読み込む"""
+    tracing.add_bytes("read", os.path.getsize(path))
+    with np.load(path, allow_pickle=False) as data:
+        return ChartColumns(
+            [str(a) for a in data["archetypes"]],
+            data["archetype_ids"],
+            data["beats"],
+            data["bpms"],
+            data["has_data"],
+            float(data["total_weight"]),
+        )
@@ -1,58 +1,128 @@
 import requests
 import os
 import gzip
+import io
 import shutil
-import json
+import threading
+from typing import Optional
+from requests.adapters import HTTPAdapter
 from PIL import Image
 from src.config import SERVER_MAP
+from src import tracing
+from src.pipeline import PIPELINE_WORKERS
+from src.modules.http_cache import HttpCache
+from src.modules.transfer import Download, TransferProgress, download_file
+from src.modules.level_context import LevelContext
+from src.modules.chart_columns import ChartColumns, build_chart_columns_from_fields, iter_chart_entity_fields, iter_gunzip, load_chart_columns
 
-def download_and_prepare_assets(prefix: str, id_part: str, dist_dir: str) -> str:
-    """
-    指定サーバーから譜面データをダウンロードし、ジャケットをリサイズする。
-    成功した場合、完全な譜面IDを返す。
-    """
+# 接続を使い回すための共有セッション
+_session = None
+_session_lock = threading.Lock()
+
+
+def _get_session() -> requests.Session:
+    """プロセス内で共有する requests.Session を返す (同じサーバーへの接続は keep-alive で使い回す)"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            # 同じサーバーへの同時接続は、ステージを実行するスレッドの数まで使い回す
+            adapter = HTTPAdapter(pool_connections=len(SERVER_MAP) + 4, pool_maxsize=PIPELINE_WORKERS)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+
+def fetch_level(prefix: str, id_part: str, dist_dir: str) -> LevelContext:
+    """譜面の情報を API から取得し、item を入れた LevelContext を返す"""
     base_url = SERVER_MAP.get(prefix)
     if not base_url:
         raise ValueError(f"サポートされていないサーバー接頭辞です: {prefix}")
 
     api_url = f"{base_url}{prefix}-{id_part}"
-    full_level_id = f"{prefix}-{id_part}"
     
     print(f"APIにアクセスしています: {api_url}")
-    response = requests.get(api_url, timeout=15)
+    response = _get_session().get(api_url, timeout=15)
     response.raise_for_status()
     api_response_data = response.json()
 
     os.makedirs(dist_dir, exist_ok=True)
-    
-    with open(os.path.join(dist_dir, "level.json"), 'w', encoding='utf-8') as f:
-        json.dump(api_response_data, f, indent=4)
 
     print(f"ファイルを '{dist_dir}' に保存します。")
-    item = api_response_data.get("item", {})
-    
-    _download_file(item["cover"]["url"], os.path.join(dist_dir, "jacket.jpg"))
-    _resize_jacket(os.path.join(dist_dir, "jacket.jpg"))
-    _download_file(item["bgm"]["url"], os.path.join(dist_dir, "music.mp3"))
-    
+    return LevelContext(f"{prefix}-{id_part}", dist_dir, api_response_data.get("item", {}))
+
+def prepare_jacket(url: str, dist_dir: str, http_cache: Optional[HttpCache] = None,
+                   progress: Optional[TransferProgress] = None) -> Image.Image:
+    """ジャケットをダウンロードしてリサイズし、デコード済みの画像を返す (jacket.jpg は AviUtl 用に残す)"""
+    jacket_path = os.path.join(dist_dir, "jacket.jpg")
+    _download_file(url, jacket_path, None, http_cache, progress)
+    return _resize_jacket(jacket_path)
+
+def download_bgm(url: str, dist_dir: str, http_cache: Optional[HttpCache] = None,
+                 progress: Optional[TransferProgress] = None) -> str:
+    """BGM をダウンロードし、そのパスを返す"""
+    bgm_path = os.path.join(dist_dir, "music.mp3")
+    _download_file(url, bgm_path, None, http_cache, progress)
+    return bgm_path
+
+def prepare_chart(url: str, dist_dir: str, keep_chart_file: bool = False, http_cache: Optional[HttpCache] = None,
+                  progress: Optional[TransferProgress] = None) -> ChartColumns:
+    """譜面をダウンロードして ChartColumns を返す (keep_chart_file が True なら chart.json も残す)"""
+    if not keep_chart_file:
+        return _stream_chart_columns(url, None, http_cache, progress)
+
     chart_gz_path = os.path.join(dist_dir, "chart.json.gz")
-    _download_file(item["data"]["url"], chart_gz_path)
-    _unzip_gz(chart_gz_path, os.path.join(dist_dir, "chart.json"))
-    
-    return full_level_id
-
-def _download_file(url: str, dest_path: str):
-    with requests.get(url, stream=True, timeout=15) as r:
-        r.raise_for_status()
-        with open(dest_path, 'wb') as f:
-            shutil.copyfileobj(r.raw, f)
-
-def _resize_jacket(image_path: str, size: tuple[int, int] = (512, 512)):
-    with Image.open(image_path).convert("RGB") as img:
-        if img.size != size:
-            print(f"  -> jacket.jpgを{size[0]}x{size[1]}にリサイズしています...")
-            resized_img = img.resize(size, Image.Resampling.LANCZOS)
-            resized_img.save(image_path, "jpeg", quality=95)
+    chart_path = os.path.join(dist_dir, "chart.json")
+    _download_file(url, chart_gz_path, None, http_cache, progress)
+    _unzip_gz(chart_gz_path, chart_path)
+    return load_chart_columns(chart_path)
+
+def _download_file(url: str, dest_path: str, session: Optional[requests.Session] = None,
+                   http_cache: Optional[HttpCache] = None, progress: Optional[TransferProgress] = None):
+    with tracing.span("download", file=os.path.basename(dest_path)):
+        if http_cache is not None:
+            http_cache.fetch(url, dest_path, session or _get_session(), progress)
+            return
+        download_file(session or _get_session(), url, dest_path, progress)
+
+def _stream_chart_columns(url: str, session: Optional[requests.Session] = None,
+                          http_cache: Optional[HttpCache] = None,
+                          progress: Optional[TransferProgress] = None) -> ChartColumns:
+    """gzip圧縮された譜面をダウンロードしながら展開・解析する。一時ファイルは作らない"""
+    with tracing.span("chart_stream"):
+        if http_cache is not None:
+            chunks = iter(http_cache.iter_content(url, session or _get_session(), progress))
+        else:
+            chunks = iter(Download(session or _get_session(), url, progress=progress))
+        columns = build_chart_columns_from_fields(iter_chart_entity_fields(iter_gunzip(chunks)))
+        # JSON の後ろに残った部分 (gzip の末尾など) も読み切って、キャッシュへの保存を完了させる
+        for _ in chunks:
+            pass
+        return columns
+
+def _resize_jacket(image_path: str, size: tuple[int, int] = (512, 512)) -> Image.Image:
+    """ジャケットを size にリサイズして保存し、保存した内容をデコードした画像を返す"""
+    with tracing.span("resize_jacket"), Image.open(image_path) as img:
+        img.load()
+        if img.size == size:
+            return img
+        print(f"  -> jacket.jpgを{size[0]}x{size[1]}にリサイズしています...")
+        resized_img = img.convert("RGB").resize(size, Image.Resampling.LANCZOS)
+
+    # 保存するファイルと同じ JPEG の内容からデコードし、ファイルを読み直さずに済ませる
+    buffer = io.BytesIO()
+    resized_img.save(buffer, "jpeg", quality=95)
+    # キャッシュからリンクしたファイルを書き換えないよう、別のファイルに保存してから置き換える
+    temp_path = image_path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(buffer.getbuffer())
+    tracing.add_bytes("written", buffer.getbuffer().nbytes)
+    os.replace(temp_path, image_path)
+    buffer.seek(0)
+    jacket = Image.open(buffer)
+    jacket.load()
+    return jacket
 
 def _unzip_gz(gz_path: str, dest_path: str):
     with gzip.open(gz_path, 'rb') as f_in:
@@ -0,0 +1,83 @@
+import os
+import shutil
+import hashlib
+from typing import Iterator, Tuple
+from PIL import Image
+from src.utils import resource_path
+from src import tracing
+
+# 縮小版に含めないフォルダ (AviUtl からは参照しないもの)
+DRAFT_SKIP_DIRS = ("alias", "scripts", "background")
+
+# 縮小の方法を変えたときに、古い縮小版を使わないようにするための番号
+_DRAFT_REVISION = 1
+
+
+def _iter_asset_files(assets_dir: str) -> Iterator[Tuple[str, str]]:
+    """縮小版に含めるファイルの (assets からの相対パス, 絶対パス) を名前順に返す"""
+    for root, dirs, files in os.walk(assets_dir):
+        if root == assets_dir:
+            dirs[:] = [d for d in dirs if d not in DRAFT_SKIP_DIRS]
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, assets_dir), path
+
+
+def _assets_fingerprint(assets_dir: str, scale: float) -> str:
+    """アセットのファイル一覧 (パス・サイズ・更新日時) と縮小率から指紋を作る"""
+    digest = hashlib.sha256(f"{_DRAFT_REVISION}:{scale!r}".encode())
+    for relative_path, path in _iter_asset_files(assets_dir):
+        stat = os.stat(path)
+        digest.update(f"{relative_path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def draft_assets_dir(cache_root: str, scale: float) -> str:
+    """scale で縮小したアセットを置くフォルダのパスを返す (アセットが変わるとパスも変わる)"""
+    if not 0 < scale <= 1:
+        raise ValueError(f"ドラフトの縮小率は 0 より大きく 1 以下にしてください: {scale}")
+    fingerprint = _assets_fingerprint(resource_path('assets'), scale)
+    return os.path.join(cache_root, f"{scale:g}-{fingerprint[:16]}")
+
+
+def _shrink_png(src_path: str, dest_path: str, scale: float):
+    with Image.open(src_path) as img:
+        if img.mode not in ("RGB", "RGBA", "L", "LA"):
+            img = img.convert("RGBA")
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img.resize(size, Image.Resampling.LANCZOS).save(dest_path, "PNG")
+
+
+def build_draft_assets(cache_root: str, scale: float) -> str:
+    """
+    HUD などのアセットを scale で縮小したコピーを作り、そのフォルダのパスを返す。
+    PNG 画像だけを縮小し、動画などそれ以外のファイルはそのままコピーする。
+    作成済みならそれを使う (複数のプロセスが同時に作っても、先に作り終えたものを使う)。
+    """
+    target_dir = draft_assets_dir(cache_root, scale)
+    if os.path.isdir(target_dir):
+        return target_dir
+
+    print(f"ドラフト用に縮小したアセットを '{target_dir}' に作成しています...")
+    assets_dir = resource_path('assets')
+    temp_dir = f"{target_dir}.{os.getpid()}.tmp"
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    with tracing.span("draft_assets", scale=scale):
+        for relative_path, path in _iter_asset_files(assets_dir):
+            dest_path = os.path.join(temp_dir, relative_path)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            if path.lower().endswith(".png"):
+                _shrink_png(path, dest_path, scale)
+            else:
+                shutil.copyfile(path, dest_path)
+            tracing.add_bytes("written", os.path.getsize(dest_path))
+
+    try:
+        os.rename(temp_dir, target_dir)
+    except OSError:
+        # 他のプロセスが先に作り終えた
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        if not os.path.isdir(target_dir):
+            raise
+    return target_dir
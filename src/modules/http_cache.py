@@ -0,0 +1,170 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Dict, Iterator, Optional, Tuple
+import requests
+from src.modules.cache_store import ContentCache, link_or_copy, open_cache
+from src.modules.chart_columns import CHUNK_SIZE
+from src import tracing
+from src.modules.transfer import DOWNLOAD_TIMEOUT, Download, TransferProgress, download_file, move_partial
+
+
+class HttpCache:
+    """
+    ダウンロードしたファイルのディスクキャッシュ。
+    ファイルの中身は内容の SHA-256 をキーとして保存し (同じ内容は URL が違っても1つにまとめる)、
+    URL ごとに ETag / Last-Modified と内容のハッシュを記録しておく。
+    2回目以降は条件付きリクエストで更新を確認し、変わっていなければ (304) 保存済みのファイルを使う。
+    """
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.blobs: ContentCache = open_cache(os.path.join(root, "blobs"), max_bytes)
+        self.url_dir = os.path.join(root, "urls")
+        # 中断したダウンロードを URL ごとに残しておくフォルダ (次の実行で続きから取得する)
+        self.partial_dir = os.path.join(root, "partial")
+
+    @classmethod
+    def open(cls, root: str, max_bytes: int) -> Optional["HttpCache"]:
+        """キャッシュのフォルダを作って開く。作れない場合 (同じ名前のファイルがあるなど) は None を返す"""
+        try:
+            os.makedirs(root, exist_ok=True)
+        except OSError as e:
+            print(f"ダウンロードのキャッシュを使用できないため、キャッシュせずにダウンロードします: {e}")
+            return None
+        return cls(root, max_bytes)
+
+    def _meta_path(self, url: str) -> str:
+        return os.path.join(self.url_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + ".json")
+
+    def _load_meta(self, url: str) -> Optional[dict]:
+        try:
+            with open(self._meta_path(url), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get("url") == url else None
+
+    def _save_meta(self, url: str, headers: Dict[str, str], sha256: str, size: int):
+        meta = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "sha256": sha256,
+            "size": size,
+        }
+        try:
+            os.makedirs(self.url_dir, exist_ok=True)
+            temp_path = self._meta_path(url) + f".{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(temp_path, self._meta_path(url))
+        except OSError as e:
+            print(f"キャッシュを保存できませんでした: {e}")
+
+    def _request(self, url: str, session: requests.Session) -> Tuple[Optional[str], Optional[requests.Response]]:
+        """
+        url を取得する。保存済みのファイルが最新なら (そのパス, None) を、
+        そうでなければ (None, 本文を読み出す前のレスポンス) を返す。
+        中断したダウンロードが残っていれば、続きは Download が Range で取得するので (None, None) を返す。
+        """
+        if os.path.exists(self._partial_path(url)):
+            return None, None
+        meta = self._load_meta(url)
+        headers = {}
+        if meta and os.path.isfile(self.blobs.path_for(meta["sha256"])):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        if response.status_code == 304 and headers:
+            response.close()
+            path = self.blobs.lookup(meta["sha256"])
+            if path is not None:
+                print(f"  -> キャッシュを使用します: {url}")
+                return path, None
+            # 確認中に削除された場合は取得し直す
+            response = session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT)
+        return None, response
+
+    def _partial_path(self, url: str) -> str:
+        return os.path.join(self.partial_dir, hashlib.sha256(url.encode('utf-8')).hexdigest() + ".part")
+
+    def _temp_path(self, url: str) -> Optional[str]:
+        """
+        本文を書き込む一時ファイルのパス。キャッシュのフォルダを作れなければ None。
+        中断したダウンロードが残っていれば、このパスに移して続きから取得する (同時に取得する他のプロセスとは共有しない)。
+        """
+        try:
+            os.makedirs(self.partial_dir, exist_ok=True)
+        except OSError as e:
+            print(f"  -> キャッシュに書き込めないため、キャッシュせずにダウンロードします: {e}")
+            return None
+        temp_path = f"{self._partial_path(url)}.{os.getpid()}.{threading.get_ident()}"
+        move_partial(self._partial_path(url), temp_path)
+        return temp_path
+
+    def _iter_response(self, url: str, response: Optional[requests.Response], session: requests.Session,
+                       progress: Optional[TransferProgress], temp_path: str, result: list) -> Iterator[bytes]:
+        """
+        レスポンスの本文を返しながら temp_path に書き込み、キャッシュに保存する。
+        最後まで読むと result に保存先のパス (保存できなかった場合は None) を入れる
+        """
+        download = Download(session, url, temp_path, progress, response=response, resume=True)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            for chunk in download:
+                digest.update(chunk)
+                size += len(chunk)
+                yield chunk
+            sha256 = digest.hexdigest()
+            path = self.blobs.store(sha256, temp_path, move=True)
+        except BaseException:
+            # 次の実行で続きから取得できるように残す
+            move_partial(temp_path, self._partial_path(url))
+            raise
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if path is not None:
+            self._save_meta(url, download.headers, sha256, size)
+        result.append(path)
+
+    def iter_content(self, url: str, session: requests.Session,
+                     progress: Optional[TransferProgress] = None) -> Iterator[bytes]:
+        """url の内容をチャンクごとに返す。キャッシュが最新ならネットワークからは読まない"""
+        path, response = self._request(url, session)
+        if path is not None:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    tracing.add_bytes("read", len(chunk))
+                    yield chunk
+            return
+        temp_path = self._temp_path(url)
+        if temp_path is None:
+            yield from Download(session, url, None, progress, response=response)
+            return
+        yield from self._iter_response(url, response, session, progress, temp_path, [])
+
+    def fetch(self, url: str, dest_path: str, session: requests.Session,
+              progress: Optional[TransferProgress] = None):
+        """url の内容を dest_path に保存する (キャッシュからはハードリンクまたはコピー)"""
+        path, response = self._request(url, session)
+        if path is None:
+            result = []
+            temp_path = self._temp_path(url)
+            if temp_path is None:
+                if response is not None:
+                    response.close()
+            else:
+                for _ in self._iter_response(url, response, session, progress, temp_path, result):
+                    pass
+            path = result[0] if result else None
+            if path is None:
+                # キャッシュに保存できなかった場合は、キャッシュを使わずに取得し直す
+                download_file(session, url, dest_path, progress)
+                return
+        link_or_copy(path, dest_path)
@@ -1,51 +1,257 @@
 import os
 import sys
-from typing import List, Tuple
+import json
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
 import cv2
 import numpy as np
 from PIL import Image
 from src.utils import resource_path
+from src.modules.cache_store import ContentCache
+from src.modules.background_variant import BackgroundVariant
+from src import tracing
+
+BACKGROUND_FILENAME = "background.png"
+
+# 背景バージョンごとのテンプレート画像 (assets/background/v*/<名前>.png)
+TEMPLATE_NAMES = {
+    "3": ["base", "bottom", "center_cover", "center_mask", "side_cover", "side_mask", "windows"],
+    "1": ["base", "side_mask", "center_mask", "mirror_mask", "frames"],
+}
+
+# ジャケットを貼り付ける四角形 (左上, 右上, 左下, 右下)
+QUADS = {
+    "3": {
+        "left_normal": [(566, 161), (1183, 134), (633, 731), (1226, 682)],
+        "right_normal": [(966, 104), (1413, 72), (954, 525), (1390, 524)],
+        "left_mirror": [(633, 1071), (1256, 1045), (598, 572), (1197, 569)],
+        "right_mirror": [(954, 1122), (1393, 1167), (942, 702), (1366, 717)],
+        "center_normal": [(824, 227), (1224, 227), (833, 608), (1216, 608)],
+        "center_mirror": [(830, 1017), (1214, 1017), (833, 676), (1216, 676)],
+    },
+    "1": {
+        "left_normal": [(449, 114), (1136, 99), (465, 804), (1152, 789)],
+        "right_normal": [(1018, 92), (1635, 51), (1026, 756), (1630, 740)],
+        "center_normal": [(798, 193), (1252, 193), (801, 635), (1246, 635)],
+        "center_mirror": [(798, 1152), (1252, 1152), (795, 713), (1252, 713)],
+    },
+}
+
+# 変形用マップの形式を変えたときに、ディスク上の古いマップを使わないようにするための番号
+_WARP_MAP_FORMAT = 1
+
+# 合成処理を変えたときに、描画キャッシュの古い画像を使わないようにするための番号
+_RENDERER_REVISION = 2
+
+# デコード済みテンプレート画像のプロセス内キャッシュ (バージョン -> 名前 -> RGBA画像)
+_template_cache: Dict[str, Dict[str, Image.Image]] = {}
+_template_cache_lock = threading.Lock()
+
+# 変形用マップのプロセス内キャッシュ ((四角形, ジャケットのサイズ) -> (map1, map2, 左上の座標))
+_warp_map_cache: Dict[Tuple, Tuple[np.ndarray, np.ndarray, Tuple[int, int]]] = {}
+_warp_map_cache_lock = threading.Lock()
+
+# 描画キャッシュのキーに含める、バージョンごとの合成処理とテンプレート画像の指紋
+_render_fingerprints: Dict[str, str] = {}
+_render_fingerprints_lock = threading.Lock()
+
+
+def _load_template_image(version: str, name: str, cache_dir: Optional[str]) -> Image.Image:
+    """
+    テンプレート画像を RGBA で読み込む。
+    cache_dir が指定されていれば、デコード済みの画素を .npy として保存し、次回からメモリマップで読み込む。
+    キャッシュは元画像の更新日時とサイズが変わると作り直す。
+    """
+    source_path = resource_path(os.path.join("assets", "background", f"v{version}", f"{name}.png"))
+    if not cache_dir:
+        tracing.add_bytes("read", os.path.getsize(source_path))
+        return Image.open(source_path).convert("RGBA")
+
+    stat = os.stat(source_path)
+    source_info = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+    npy_path = os.path.join(cache_dir, "templates", f"v{version}", f"{name}.npy")
+    info_path = os.path.join(cache_dir, "templates", f"v{version}", f"{name}.json")
 
+    try:
+        with open(info_path, 'r', encoding='utf-8') as f:
+            if json.load(f) == source_info:
+                return Image.fromarray(np.load(npy_path, mmap_mode='r'))
+    except (OSError, ValueError):
+        pass
+
+    tracing.add_bytes("read", stat.st_size)
+    image = Image.open(source_path).convert("RGBA")
+    try:
+        os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+        np.save(npy_path, np.asarray(image))
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(source_info, f)
+    except OSError as e:
+        # キャッシュを書けなくても画像の生成は続ける
+        print(f"テンプレート画像のキャッシュを保存できませんでした: {e}")
+    return image
 
 
-def _morph(image_pil: Image.Image, target_coords: List[Tuple[int, int]], target_size: Tuple[int, int]) -> Image.Image:
-    # 1. ターゲット座標のバウンディングボックスを計算
+def _load_templates(version: str, cache_dir: Optional[str] = None) -> Dict[str, Image.Image]:
+    """
+    背景バージョンのテンプレート画像をまとめて読み込む。
+    一度読み込んだ画像はプロセス内で使い回すため、呼び出し側で変更してはならない。
+    """
+    with _template_cache_lock:
+        templates = _template_cache.get(version)
+        if templates is None:
+            templates = {name: _load_template_image(version, name, cache_dir) for name in TEMPLATE_NAMES[version]}
+            _template_cache[version] = templates
+    return templates
+
+
+def _build_warp_map(target_coords: List[Tuple[int, int]], src_size: Tuple[int, int]) -> Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
+    """
+    ジャケット画像 (src_size) を target_coords の四角形に射影変換するための cv2.remap 用マップを作る。
+    出力はバウンディングボックスの大きさで、各画素に対応するジャケット上の座標を固定小数点形式で持つ。
+    バウンディングボックスが空の場合は None を返す。
+    """
+    # バウンディングボックスを計算
     min_x = min(p[0] for p in target_coords)
     min_y = min(p[1] for p in target_coords)
     max_x = max(p[0] for p in target_coords)
     max_y = max(p[1] for p in target_coords)
     bbox_w, bbox_h = int(max_x - min_x), int(max_y - min_y)
-
     if bbox_w <= 0 or bbox_h <= 0:
-        return Image.new("RGBA", target_size, (0, 0, 0, 0))
-
-    # 2. 元画像をバウンディングボックスのサイズにリサイズ
-    resized_pil = image_pil.resize((bbox_w, bbox_h), Image.Resampling.NEAREST)
+        return None
 
-    # Pillow -> OpenCV 形式 (RGBA -> BGRA)
-    resized_cv = cv2.cvtColor(np.array(resized_pil), cv2.COLOR_RGBA2BGRA)
-    src_h, src_w, _ = resized_cv.shape
+    # バウンディングボックスの左上を原点とした座標で射影変換行列を求める
+    src_w, src_h = src_size
     src_points = np.float32([[0, 0], [src_w, 0], [0, src_h], [src_w, src_h]])
+    relative_target_coords = np.float32([(p[0] - min_x, p[1] - min_y) for p in target_coords])
+    inverse = np.linalg.inv(cv2.getPerspectiveTransform(src_points, relative_target_coords))
 
-    # 3. 射影変換のための座標を計算（バウンディングボックスの左上を原点とする相対座標）
-    relative_target_coords = np.float32([
-        (p[0] - min_x, p[1] - min_y) for p in target_coords
-    ])
+    # 出力の各画素をジャケット上の座標に逆変換する
+    xs, ys = np.meshgrid(np.arange(bbox_w, dtype=np.float64), np.arange(bbox_h, dtype=np.float64))
+    w = inverse[2, 0] * xs + inverse[2, 1] * ys + inverse[2, 2]
+    map_x = ((inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]) / w).astype(np.float32)
+    map_y = ((inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]) / w).astype(np.float32)
 
-    # 4. 射影変換行列を計算し、ワープを実行
-    matrix = cv2.getPerspectiveTransform(src_points, relative_target_coords)
-    projected_cv = cv2.warpPerspective(resized_cv, matrix, (bbox_w, bbox_h))
+    map1, map2 = cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+    return map1, map2, (int(min_x), int(min_y))
 
-    # OpenCV -> Pillow 形式 (BGRA -> RGBA)
-    projected_pil = Image.fromarray(cv2.cvtColor(projected_cv, cv2.COLOR_BGRA2RGBA))
 
-    # 5. 最終的な出力用画像に、計算した位置へ貼り付け
-    final_image = Image.new("RGBA", target_size, (0, 0, 0, 0))
-    final_image.paste(projected_pil, (int(min_x), int(min_y)))
+def _get_warp_map(target_coords: List[Tuple[int, int]], src_size: Tuple[int, int],
+                  cache_dir: Optional[str] = None) -> Optional[Tuple[np.ndarray, np.ndarray, Tuple[int, int]]]:
+    """
+    変形用マップを取得する。プロセス内でキャッシュし、cache_dir が指定されていればディスクにも保存する。
+    """
+    key = (tuple(tuple(p) for p in target_coords), tuple(src_size))
+    with _warp_map_cache_lock:
+        if key in _warp_map_cache:
+            return _warp_map_cache[key]
+
+    warp_map = None
+    map_path = None
+    if cache_dir:
+        digest = hashlib.sha1(repr((_WARP_MAP_FORMAT,) + key).encode()).hexdigest()
+        map_path = os.path.join(cache_dir, "warp_maps", f"{digest}.npz")
+        try:
+            with np.load(map_path) as data:
+                warp_map = (data["map1"], data["map2"], tuple(int(v) for v in data["offset"]))
+        except (OSError, ValueError, KeyError):
+            warp_map = None
+
+    if warp_map is None:
+        warp_map = _build_warp_map(target_coords, src_size)
+        if warp_map is not None and map_path:
+            try:
+                os.makedirs(os.path.dirname(map_path), exist_ok=True)
+                temp_path = map_path + ".tmp.npz"
+                np.savez(temp_path, map1=warp_map[0], map2=warp_map[1], offset=np.array(warp_map[2]))
+                os.replace(temp_path, map_path)
+            except OSError as e:
+                print(f"変形用マップのキャッシュを保存できませんでした: {e}")
+
+    with _warp_map_cache_lock:
+        _warp_map_cache[key] = warp_map
+    return warp_map
+
+
+def _morph_patch(image_pil: Image.Image, target_coords: List[Tuple[int, int]],
+                 cache_dir: Optional[str] = None) -> Tuple[Optional[Image.Image], Tuple[int, int]]:
+    """
+    画像を target_coords の四角形に射影変換する。
+    戻り値は変形後の画像 (バウンディングボックスの大きさ) と、その左上の座標。
+    バウンディングボックスが空の場合、画像は None になる。
+    """
+    with tracing.span("morph"):
+        warp_map = _get_warp_map(target_coords, image_pil.size, cache_dir)
+        if warp_map is None:
+            return None, (int(min(p[0] for p in target_coords)), int(min(p[1] for p in target_coords)))
+
+        map1, map2, offset = warp_map
+        projected = cv2.remap(np.asarray(image_pil), map1, map2, cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
+        return Image.fromarray(projected), offset
+
 
+def _morph(image_pil: Image.Image, target_coords: List[Tuple[int, int]], target_size: Tuple[int, int]) -> Image.Image:
+    """_morph_patch の結果を target_size の透明な画像に貼り付けて返す"""
+    patch, offset = _morph_patch(image_pil, target_coords)
+    final_image = Image.new("RGBA", target_size, (0, 0, 0, 0))
+    if patch is not None:
+        final_image.paste(patch, offset)
     return final_image
 
 
+def _clip_patch(patch: Image.Image, offset: Tuple[int, int], size: Tuple[int, int]) -> Tuple[Optional[Image.Image], Tuple[int, int]]:
+    """画像の範囲からはみ出した部分を切り落とす。重なりがなければ None を返す"""
+    left, top = max(offset[0], 0), max(offset[1], 0)
+    right = min(offset[0] + patch.width, size[0])
+    bottom = min(offset[1] + patch.height, size[1])
+    if right <= left or bottom <= top:
+        return None, (left, top)
+    if (left, top, right, bottom) != (offset[0], offset[1], offset[0] + patch.width, offset[1] + patch.height):
+        patch = patch.crop((left - offset[0], top - offset[1], right - offset[0], bottom - offset[1]))
+    return patch, (left, top)
+
+
+def _composite_patch(layer: Image.Image, patch: Optional[Image.Image], offset: Tuple[int, int]) -> None:
+    """layer の patch が重なる範囲だけに patch を合成する (layer を直接書き換える)"""
+    if patch is None:
+        return
+    patch, offset = _clip_patch(patch, offset, layer.size)
+    if patch is not None:
+        layer.alpha_composite(patch, dest=offset)
+
+
+def _mask_patch(patch: Optional[Image.Image], offset: Tuple[int, int], mask_pil: Image.Image) -> Optional[Image.Image]:
+    """patch が重なる範囲のマスクだけを使って _mask を適用する"""
+    if patch is None:
+        return None
+    box = (offset[0], offset[1], offset[0] + patch.width, offset[1] + patch.height)
+    return _mask(patch, mask_pil.crop(box))
+
+
+def _union_box(size: Tuple[int, int], *patches: Tuple[Optional[Image.Image], Tuple[int, int]]) -> Optional[Tuple[int, int, int, int]]:
+    """複数の patch を囲む範囲 (画像内に収まるよう切り詰めたもの) を返す"""
+    boxes = [
+        (offset[0], offset[1], offset[0] + patch.width, offset[1] + patch.height)
+        for patch, offset in patches if patch is not None
+    ]
+    if not boxes:
+        return None
+    left = max(min(b[0] for b in boxes), 0)
+    top = max(min(b[1] for b in boxes), 0)
+    right = min(max(b[2] for b in boxes), size[0])
+    bottom = min(max(b[3] for b in boxes), size[1])
+    if right <= left or bottom <= top:
+        return None
+    return (left, top, right, bottom)
+
+
+def _mask_region(layer: Image.Image, mask_pil: Image.Image, box: Tuple[int, int, int, int]) -> None:
+    """layer の box の範囲だけに _mask を適用する (範囲外は透明である前提。layer を直接書き換える)"""
+    layer.paste(_mask(layer.crop(box), mask_pil.crop(box)), box[:2])
+
+
 def _mask(image_pil: Image.Image, mask_pil: Image.Image) -> Image.Image:
     if image_pil.mode != 'RGBA':
         image_pil = image_pil.convert('RGBA')
@@ -66,39 +272,32 @@ def _mask(image_pil: Image.Image, mask_pil: Image.Image) -> Image.Image:
     return result_pil
 
 
-def _render_v3(target_image: Image.Image) -> Image.Image:
+def _render_v3(target_image: Image.Image, cache_dir: Optional[str] = None) -> Image.Image:
     """v3の背景画像を生成します。"""
-    # アセット画像の読み込み
-    base = Image.open(resource_path(os.path.join("assets", "background", "v3", "base.png"))).convert("RGBA")
-    bottom = Image.open(resource_path(os.path.join("assets", "background", "v3", "bottom.png"))).convert("RGBA")
-    center_cover = Image.open(resource_path(os.path.join("assets", "background", "v3", "center_cover.png"))).convert("RGBA")
-    center_mask = Image.open(resource_path(os.path.join("assets", "background", "v3", "center_mask.png"))).convert("RGBA")
-    side_cover = Image.open(resource_path(os.path.join("assets", "background", "v3", "side_cover.png"))).convert("RGBA")
-    side_mask = Image.open(resource_path(os.path.join("assets", "background", "v3", "side_mask.png"))).convert("RGBA")
-    windows = Image.open(resource_path(os.path.join("assets", "background", "v3", "windows.png"))).convert("RGBA")
+    templates = _load_templates("3", cache_dir)
+    quads = QUADS["3"]
+    base = templates["base"]
+    bottom = templates["bottom"]
+    center_cover = templates["center_cover"]
+    center_mask = templates["center_mask"]
+    side_cover = templates["side_cover"]
+    side_mask = templates["side_mask"]
+    windows = templates["windows"]
 
     base_size = base.size
     
-    # サイドジャケットの生成
+    # サイドジャケットの生成 (変形した範囲だけを合成する)
     side_jackets = Image.new("RGBA", base_size)
-    left_normal = _morph(target_image, [(566, 161), (1183, 134), (633, 731), (1226, 682)], base_size)
-    right_normal = _morph(target_image, [(966, 104), (1413, 72), (954, 525), (1390, 524)], base_size)
-    left_mirror = _morph(target_image, [(633, 1071), (1256, 1045), (598, 572), (1197, 569)], base_size)
-    right_mirror = _morph(target_image, [(954, 1122), (1393, 1167), (942, 702), (1366, 717)], base_size)
-
-    side_jackets = Image.alpha_composite(side_jackets, left_normal)
-    side_jackets = Image.alpha_composite(side_jackets, right_normal)
-    side_jackets = Image.alpha_composite(side_jackets, left_mirror)
-    side_jackets = Image.alpha_composite(side_jackets, right_mirror)
+    _composite_patch(side_jackets, *_morph_patch(target_image, quads["left_normal"], cache_dir))
+    _composite_patch(side_jackets, *_morph_patch(target_image, quads["right_normal"], cache_dir))
+    _composite_patch(side_jackets, *_morph_patch(target_image, quads["left_mirror"], cache_dir))
+    _composite_patch(side_jackets, *_morph_patch(target_image, quads["right_mirror"], cache_dir))
     side_jackets = Image.alpha_composite(side_jackets, side_cover)
 
     # センタージャケットの生成
     center = Image.new("RGBA", base_size)
-    center_normal = _morph(target_image, [(824, 227), (1224, 227), (833, 608), (1216, 608)], base_size)
-    center_mirror = _morph(target_image, [(830, 1017), (1214, 1017), (833, 676), (1216, 676)], base_size)
-    
-    center = Image.alpha_composite(center, center_normal)
-    center = Image.alpha_composite(center, center_mirror)
+    _composite_patch(center, *_morph_patch(target_image, quads["center_normal"], cache_dir))
+    _composite_patch(center, *_morph_patch(target_image, quads["center_mirror"], cache_dir))
     center = Image.alpha_composite(center, center_cover)
 
     # マスキング処理
@@ -115,38 +314,37 @@ def _render_v3(target_image: Image.Image) -> Image.Image:
 
     return final_image
 
-def _render_v1(target_image: Image.Image) -> Image.Image:
+def _render_v1(target_image: Image.Image, cache_dir: Optional[str] = None) -> Image.Image:
     """v1の背景画像を生成します。"""
-    # アセット画像の読み込み
-    base = Image.open(resource_path(os.path.join("assets", "background", "v1", "base.png"))).convert("RGBA")
-    side_mask = Image.open(resource_path(os.path.join("assets", "background", "v1", "side_mask.png"))).convert("RGBA")
-    center_mask = Image.open(resource_path(os.path.join("assets", "background", "v1", "center_mask.png"))).convert("RGBA")
-    mirror_mask = Image.open(resource_path(os.path.join("assets", "background", "v1", "mirror_mask.png"))).convert("RGBA")
-    frames = Image.open(resource_path(os.path.join("assets", "background", "v1", "frames.png"))).convert("RGBA")
+    templates = _load_templates("1", cache_dir)
+    quads = QUADS["1"]
+    base = templates["base"]
+    side_mask = templates["side_mask"]
+    center_mask = templates["center_mask"]
+    mirror_mask = templates["mirror_mask"]
+    frames = templates["frames"]
     
     base_size = base.size
 
-    # サイドジャケットの生成
+    # サイドジャケットの生成 (変形した範囲だけを合成する)
     side_jackets = Image.new("RGBA", base_size)
-    left_normal = _morph(target_image, [(449, 114), (1136, 99), (465, 804), (1152, 789)], base_size)
-    right_normal = _morph(target_image, [(1018, 92), (1635, 51), (1026, 756), (1630, 740)], base_size)
+    left_normal, left_offset = _morph_patch(target_image, quads["left_normal"], cache_dir)
+    right_normal, right_offset = _morph_patch(target_image, quads["right_normal"], cache_dir)
+    _composite_patch(side_jackets, left_normal, left_offset)
+    _composite_patch(side_jackets, right_normal, right_offset)
 
-    side_jackets = Image.alpha_composite(side_jackets, left_normal)
-    side_jackets = Image.alpha_composite(side_jackets, right_normal)
-    
     # センタージャケットの生成
     center = Image.new("RGBA", base_size)
-    center_normal = _morph(target_image, [(798, 193), (1252, 193), (801, 635), (1246, 635)], base_size)
-    center_mirror = _morph(target_image, [(798, 1152), (1252, 1152), (795, 713), (1252, 713)], base_size)
+    center_normal, center_offset = _morph_patch(target_image, quads["center_normal"], cache_dir)
+    center_mirror, mirror_offset = _morph_patch(target_image, quads["center_mirror"], cache_dir)
 
-    # マスキング処理
-    center_normal = _mask(center_normal, center_mask)
-    center_mirror = _mask(center_mirror, mirror_mask)
-    
-    center = Image.alpha_composite(center, center_normal)
-    center = Image.alpha_composite(center, center_mirror)
+    # マスキング処理 (ジャケットが重なる範囲のみ)
+    _composite_patch(center, _mask_patch(center_normal, center_offset, center_mask), center_offset)
+    _composite_patch(center, _mask_patch(center_mirror, mirror_offset, mirror_mask), mirror_offset)
 
-    side_jackets = _mask(side_jackets, side_mask)
+    side_box = _union_box(side_jackets.size, (left_normal, left_offset), (right_normal, right_offset))
+    if side_box is not None:
+        _mask_region(side_jackets, side_mask, side_box)
 
     # 最終的な合成
     final_image = base.copy()
@@ -157,33 +355,319 @@ def _render_v1(target_image: Image.Image) -> Image.Image:
     return final_image
 
 
-def generate_background_image(level_id: str, version: str, dist_dir: str) -> None:
+# 背景画像の生成に使う合成処理 (バージョン -> 関数)
+_RENDERERS = {"3": _render_v3, "1": _render_v1}
+
+
+# 合成エンジン (premultiplied alpha の float32 配列で、レイヤー構成全体を帯ごとに1回で評価する)
+# メモリは PIL 版より少ないが、PIL 版 (_RENDERERS) より遅いため背景画像の生成には使っていない。
+# 各レイヤーは ("layer", 名前) か ("mask", [子レイヤー], マスク名)。名前はテンプレート名か QUADS のキー。
+# ("mask", ...) は子レイヤーを合成した結果のアルファとマスクのアルファの小さい方を取る (_mask と同じ)。
+LAYER_STACKS = {
+    "3": [
+        ("layer", "base"),
+        ("mask", [("layer", "left_normal"), ("layer", "right_normal"), ("layer", "left_mirror"),
+                  ("layer", "right_mirror"), ("layer", "side_cover")], "side_mask"),
+        ("layer", "side_cover"),
+        ("layer", "windows"),
+        ("mask", [("layer", "center_normal"), ("layer", "center_mirror"), ("layer", "center_cover")], "center_mask"),
+        ("layer", "bottom"),
+    ],
+    "1": [
+        ("layer", "base"),
+        ("mask", [("layer", "left_normal"), ("layer", "right_normal")], "side_mask"),
+        ("mask", [("layer", "center_normal")], "center_mask"),
+        ("mask", [("layer", "center_mirror")], "mirror_mask"),
+        ("layer", "frames"),
+    ],
+}
+
+# 合成エンジンの結果と PIL 版 (_render_v3 / _render_v1) の結果の、各チャンネルの差の最大値。
+# PIL は 8bit の整数演算で1回ごとに丸めるが、こちらは最後に1回だけ丸めるため、その分だけずれる。
+FUSED_TOLERANCE = 2
+
+# 一度に処理する範囲 (帯の行数とタイルの列数)。レイヤーはタイルごとに不透明な範囲だけを処理する
+FUSED_BAND_HEIGHT = 128
+FUSED_TILE_WIDTH = 256
+
+# 合成エンジン用に変換したテンプレート画像のプロセス内キャッシュ ((バージョン, 名前) -> _FusedSource)
+_fused_source_cache: Dict[Tuple[str, str], "_FusedSource"] = {}
+_fused_source_cache_lock = threading.Lock()
+
+
+def _alpha_bbox(alpha: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """アルファの配列 (行, 列) が 0 でない範囲を返す。全て透明なら None"""
+    rows = np.flatnonzero(alpha.any(axis=1))
+    if rows.size == 0:
+        return None
+    cols = np.flatnonzero(alpha.any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def _intersect(a: Tuple[int, int, int, int], b: Optional[Tuple[int, int, int, int]]) -> Optional[Tuple[int, int, int, int]]:
+    if b is None:
+        return None
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right, bottom = min(a[2], b[2]), min(a[3], b[3])
+    if right <= left or bottom <= top:
+        return None
+    return (left, top, right, bottom)
+
+
+class _FusedSource:
+    """
+    合成エンジンに渡す1枚の画像。
+    straight alpha の uint8 RGBA 画素を (チャンネル, 行, 列) の順で、不透明な範囲 (bbox) だけ切り出して保持する。
+    """
+    def __init__(self, pixels: np.ndarray, offset: Tuple[int, int]):
+        bbox = _alpha_bbox(pixels[..., 3])
+        self.bbox = None
+        self.planes = None
+        if bbox is not None:
+            self.planes = np.ascontiguousarray(np.moveaxis(pixels[bbox[1]:bbox[3], bbox[0]:bbox[2]], -1, 0))
+            self.bbox = (bbox[0] + offset[0], bbox[1] + offset[1], bbox[2] + offset[0], bbox[3] + offset[1])
+        self._regions: Dict[Tuple[int, int, int, int], Optional[Tuple[int, int, int, int]]] = {}
+
+    def region(self, box: Tuple[int, int, int, int]) -> Optional[Tuple[int, int, int, int]]:
+        """box (キャンバス座標) の中でアルファが 0 でない範囲を返す。範囲はタイルごとに一度だけ調べる"""
+        if box in self._regions:
+            return self._regions[box]
+        region = _intersect(box, self.bbox)
+        if region is not None:
+            rows, cols = self._slice(region)
+            inner = _alpha_bbox(self.planes[3, rows, cols])
+            region = None if inner is None else (region[0] + inner[0], region[1] + inner[1],
+                                                 region[0] + inner[2], region[1] + inner[3])
+        self._regions[box] = region
+        return region
+
+    def _slice(self, box: Tuple[int, int, int, int]) -> Tuple[slice, slice]:
+        x, y = self.bbox[0], self.bbox[1]
+        return slice(box[1] - y, box[3] - y), slice(box[0] - x, box[2] - x)
+
+    def premultiplied(self, box: Tuple[int, int, int, int]) -> np.ndarray:
+        """box (キャンバス座標、bbox の内側) の範囲を premultiplied alpha の float32 配列として取り出す"""
+        rows, cols = self._slice(box)
+        block = self.planes[:, rows, cols].astype(np.float32)
+        block[:3] *= block[3] * (1.0 / 255.0)
+        return block
+
+    def alpha(self, box: Tuple[int, int, int, int]) -> np.ndarray:
+        rows, cols = self._slice(box)
+        return self.planes[3, rows, cols].astype(np.float32)
+
+
+def _load_fused_sources(version: str, cache_dir: Optional[str] = None) -> Dict[str, _FusedSource]:
+    """テンプレート画像を合成エンジン用に変換して返す。変換結果はプロセス内で使い回す"""
+    templates = _load_templates(version, cache_dir)
+    sources = {}
+    with _fused_source_cache_lock:
+        for name, template in templates.items():
+            source = _fused_source_cache.get((version, name))
+            if source is None:
+                source = _fused_source_cache[(version, name)] = _FusedSource(np.asarray(template), (0, 0))
+            sources[name] = source
+    return sources
+
+
+def _over(dest: np.ndarray, src: np.ndarray) -> None:
+    """premultiplied alpha の src を dest の上に重ねる (dest を直接書き換える)"""
+    remaining = src[3] * (-1.0 / 255.0)
+    remaining += 1.0
+    dest *= remaining
+    dest += src
+
+
+def _composite_layers(dest: np.ndarray, box: Tuple[int, int, int, int], layers: List[Tuple],
+                      sources: Dict[str, _FusedSource]) -> None:
+    """layers を順に dest (キャンバス上の box の範囲) に重ねる。各レイヤーは不透明な範囲だけを処理する"""
+    empty = True
+    for layer in layers:
+        if layer[0] == "mask":
+            _, children, mask_name = layer
+            mask = sources[mask_name]
+            # マスクの外側は透明になるので、マスクの不透明な範囲だけを評価すればよい
+            region = mask.region(box)
+            if region is None:
+                continue
+            group = np.zeros((4, region[3] - region[1], region[2] - region[0]), dtype=np.float32)
+            _composite_layers(group, region, children, sources)
+
+            # アルファを min(アルファ, マスク) に下げ、色も同じ比率で下げる (premultiplied のまま)
+            alpha = group[3]
+            limited = np.minimum(alpha, mask.alpha(region))
+            scale = np.divide(limited, alpha, out=np.zeros_like(alpha), where=alpha > 0)
+            group[:3] *= scale
+            group[3] = limited
+            src = group
+        else:
+            source = sources.get(layer[1])
+            region = source.region(box) if source is not None else None
+            if region is None:
+                continue
+            src = source.premultiplied(region)
+
+        if empty and region == box:
+            # まだ何も描かれていない範囲全体を覆うレイヤーは、重ねずにそのまま書き込む
+            dest[...] = src
+        else:
+            left, top = region[0] - box[0], region[1] - box[1]
+            _over(dest[:, top:top + src.shape[1], left:left + src.shape[2]], src)
+        empty = False
+
+
+def _composite_fused(layers: List[Tuple], sources: Dict[str, _FusedSource], size: Tuple[int, int],
+                     band_height: int = FUSED_BAND_HEIGHT, tile_width: int = FUSED_TILE_WIDTH) -> np.ndarray:
+    """
+    レイヤー構成全体を premultiplied alpha の float32 で帯ごとに合成し、straight alpha の uint8 RGBA 配列を返す。
+    中間画像は帯の大きさの配列だけで、画像全体の一時画像は作らない。
+    """
+    width, height = size
+    output = np.empty((height, width, 4), dtype=np.uint8)
+    for top in range(0, height, band_height):
+        bottom = min(top + band_height, height)
+        band = np.zeros((4, bottom - top, width), dtype=np.float32)
+        for left in range(0, width, tile_width):
+            right = min(left + tile_width, width)
+            _composite_layers(band[:, :, left:right], (left, top, right, bottom), layers, sources)
+
+        # straight alpha の 8bit に戻す (アルファが 0 の画素は色も 0 にする)
+        alpha = band[3]
+        scale = np.divide(255.0, alpha, out=np.zeros_like(alpha), where=alpha > 0)
+        band[:3] *= scale
+        np.rint(band, out=band)
+        np.minimum(band, 255.0, out=band)
+        cv2.merge(list(band.astype(np.uint8)), dst=output[top:bottom])
+    return output
+
+
+def _render_fused(target_image: Image.Image, version: str, cache_dir: Optional[str] = None) -> Image.Image:
+    """LAYER_STACKS の構成を合成エンジンで合成する (_render_v3 / _render_v1 と同じ画像を作る)"""
+    with tracing.span("load_templates", version=version):
+        sources = dict(_load_fused_sources(version, cache_dir))
+    for name, quad in QUADS[version].items():
+        patch, offset = _morph_patch(target_image, quad, cache_dir)
+        if patch is not None:
+            sources[name] = _FusedSource(np.asarray(patch), offset)
+
+    size = _load_templates(version, cache_dir)["base"].size
+    with tracing.span("composite", version=version):
+        return Image.fromarray(_composite_fused(LAYER_STACKS[version], sources, size))
+
+
+def render_fingerprint(version: str) -> str:
+    """合成処理 (レイヤー構成・四角形) とテンプレート画像の内容から、バージョンごとの指紋を作る"""
+    if version not in _RENDERERS:
+        raise ValueError(f"バージョン '{version}' は現在サポートされていません。")
+    with _render_fingerprints_lock:
+        fingerprint = _render_fingerprints.get(version)
+        if fingerprint is None:
+            digest = hashlib.sha256(repr((_RENDERER_REVISION, QUADS[version], LAYER_STACKS[version])).encode())
+            for name in TEMPLATE_NAMES[version]:
+                path = resource_path(os.path.join("assets", "background", f"v{version}", f"{name}.png"))
+                with open(path, 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            fingerprint = _render_fingerprints[version] = digest.hexdigest()
+    return fingerprint
+
+
+def _render_cache_key(jacket: Image.Image, version: str, size: Optional[Tuple[int, int]] = None) -> str:
+    """
+    リサイズ済みのジャケット画像 (画素)・背景バージョン・合成処理の指紋から描画キャッシュのキーを作る。
+    size はテンプレートと違う大きさで出力する場合の動画の解像度。
+    """
+    digest = hashlib.sha256(f"{jacket.mode}:{jacket.size}:".encode())
+    digest.update(jacket.tobytes())
+    jacket_digest = digest.hexdigest()
+    key = f"{jacket_digest}:{version}:{render_fingerprint(version)}"
+    if size is not None:
+        key += f":{size[0]}x{size[1]}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _save_png(image: Image.Image, output_path: str) -> None:
+    """画像を PNG で保存する (キャッシュからリンクした古いファイルは上書きせずに削除する)"""
+    if os.path.lexists(output_path):
+        os.remove(output_path)
+    with tracing.span("png_encode"):
+        image.save(output_path, "PNG")
+        tracing.add_bytes("written", os.path.getsize(output_path))
+
+
+def generate_background_image(level_id: str, version: str, dist_dir: str, cache_dir: Optional[str] = None,
+                              render_cache: Optional[ContentCache] = None,
+                              status_callback: Optional[Callable[[str], None]] = None,
+                              jacket: Optional[Image.Image] = None) -> None:
     """
     背景画像とカバー画像を合成して新しい画像を生成します。
+    jacket にデコード済みのジャケット画像を渡すと、jacket.jpg を読み直さずにそれを使います。
+    cache_dir を指定すると、デコード済みのテンプレート画像と変形用のマップをそこに保存して再利用します。
+    render_cache を指定すると、同じジャケットとバージョンで生成済みの背景画像があればそれを使います。
+    キャッシュのヒット数とミス数は status_callback に通知します。
+    結果は background.png に保存します。
     """
-    print("背景画像の生成を開始します...")
+    generate_background_variants(level_id, [BackgroundVariant(version, filename=BACKGROUND_FILENAME)], dist_dir,
+                                 cache_dir, render_cache, status_callback, jacket)
 
-    # パス設定
+
+def generate_background_variants(level_id: str, variants: List[BackgroundVariant], dist_dir: str,
+                                 cache_dir: Optional[str] = None, render_cache: Optional[ContentCache] = None,
+                                 status_callback: Optional[Callable[[str], None]] = None,
+                                 jacket: Optional[Image.Image] = None) -> List[str]:
+    """
+    背景バージョンと解像度の組 (variants) ごとの背景画像を、1回デコードしたジャケットから生成し、保存したパスを返す。
+    ファイル名は BackgroundVariant.filename。
+    ジャケットの変形と合成はバージョンごとに1回だけ行い、同じバージョンの解像度違いはその結果を拡大・縮小して作る。
+    """
+    variants = list(dict.fromkeys(variants))
+    print("背景画像の生成を開始します..." if len(variants) == 1 else f"背景画像 {len(variants)} 種類の生成を開始します...")
     cover_image_path = os.path.join(dist_dir, "jacket.jpg")
-    output_image_path = os.path.join(dist_dir, "background.png")
 
     try:
-        # カバー画像を読み込み
-        target_image = Image.open(cover_image_path).convert("RGBA")
-        
-        # バージョンに応じてレンダリング関数を呼び出し
-        if version == "3":
-            final_image = _render_v3(target_image)
-        elif version == "1":
-            final_image = _render_v1(target_image)
-        else:
-            raise ValueError(f"バージョン '{version}' は現在サポートされていません。")
-
-        # 生成した画像を保存
-        final_image.save(output_image_path, "PNG")
-        print(f"背景画像を '{output_image_path}' に保存しました。")
+        if jacket is None:
+            with Image.open(cover_image_path) as img:
+                img.load()
+                jacket = img
+
+        # 描画キャッシュに無いものだけをバージョンごとにまとめる
+        paths = []
+        pending: Dict[str, List[Tuple[BackgroundVariant, str, Optional[str]]]] = {}
+        for variant in variants:
+            output_path = os.path.join(dist_dir, variant.filename)
+            paths.append(output_path)
+            render_key = None
+            if render_cache is not None:
+                # テンプレートと同じ大きさで出力するなら background.png と同じキー
+                render_key = _render_cache_key(jacket, variant.version,
+                                               variant.resolution if variant.scale != 1 else None)
+                with tracing.span("render_cache"):
+                    hit = render_cache.fetch(render_key, output_path)
+                if status_callback:
+                    status_callback(f"背景画像を生成中... ({render_cache.stats_text()})")
+                if hit:
+                    print(f"キャッシュ済みの背景画像を '{output_path}' にコピーしました。")
+                    continue
+            pending.setdefault(variant.version, []).append((variant, output_path, render_key))
+
+        target_image = jacket.convert("RGBA") if pending else None
+        for version, outputs in pending.items():
+            # バージョンに応じたレイヤー構成を PIL で合成
+            # (_render_fused は同じ構成の合成エンジンだが、PIL 版より遅いため使っていない)
+            with tracing.span("composite", version=version):
+                rendered = _RENDERERS[version](target_image, cache_dir)
+            for variant, output_path, render_key in outputs:
+                size = variant.canvas_size(rendered.size)
+                image = rendered
+                if size != rendered.size:
+                    with tracing.span("resize", size=f"{size[0]}x{size[1]}"):
+                        image = rendered.resize(size, Image.Resampling.LANCZOS)
+                _save_png(image, output_path)
+                print(f"背景画像を '{output_path}' に保存しました。")
+                if render_key is not None:
+                    render_cache.store(render_key, output_path)
+        return paths
 
     except FileNotFoundError as e:
         raise FileNotFoundError(f"画像ファイルが見つかりませんでした: {e.filename}")
     except Exception as e:
-        raise RuntimeError(f"背景画像の生成中に予期せぬエラーが発生しました: {e}")
\ No newline at end of file
+        raise RuntimeError(f"背景画像の生成中に予期せぬエラーが発生しました: {e}")
@@ -0,0 +1,46 @@
+import os
+import json
+import hashlib
+from typing import Any, Dict, Optional
+from PIL import Image
+from src.modules.chart_columns import ChartColumns
+
+LEVEL_DUMP_FILENAME = "level.json"
+
+
+class LevelContext:
+    """
+    1つの譜面の生成に使うデータをメモリ上にまとめて持ち、各工程に渡す。
+    item は API の応答の item、chart は譜面の列、jacket はリサイズ・デコード済みのジャケット画像。
+    chart と jacket はダウンロードが終わり次第設定する。
+    """
+    def __init__(self, level_id: str, dist_dir: str, item: Dict[str, Any],
+                 chart: Optional[ChartColumns] = None, jacket: Optional[Image.Image] = None):
+        self.level_id = level_id
+        self.dist_dir = dist_dir
+        self.item = item
+        self.chart = chart
+        self.jacket = jacket
+
+    @property
+    def cover_url(self) -> str:
+        return self.item["cover"]["url"]
+
+    @property
+    def bgm_url(self) -> str:
+        return self.item["bgm"]["url"]
+
+    @property
+    def chart_url(self) -> str:
+        return self.item["data"]["url"]
+
+    def fingerprint(self) -> str:
+        """item の内容から指紋 (SHA-256) を作る (譜面の列とジャケットは含めない)"""
+        return hashlib.sha256(json.dumps(self.item, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def dump(self) -> str:
+        """デバッグ用に item を level.json として書き出し、そのパスを返す"""
+        path = os.path.join(self.dist_dir, LEVEL_DUMP_FILENAME)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"item": self.item}, f, indent=4)
+        return path
@@ -1,8 +1,13 @@
-from src.config import WEIGHT_MAP
+from src.config import SKOBJ_INDEX_FPS, WEIGHT_MAP
+import bisect
 import json
 import os
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
 from src.utils import resource_path
+from src import tracing
+from src.modules.chart_columns import ChartColumns, load_chart_columns
+from src.modules.level_context import LevelContext
 
 class BpmChange:
     def __init__(self, beat: float, bpm: float):
@@ -31,8 +36,11 @@ def _get_time_from_bpm_changes(bpm_changes: List[BpmChange], beat: float) -> flo
             break
     return ret_time
 
-def _calculate_score_frames(level_info: Dict[str, Any], level_data: Dict[str, Any], power: float) -> Tuple[List[Dict[str, Any]], float]:
-    """スコア、コンボ、秒数、ランク、スコアバーのフレームリストを計算する"""
+def _calculate_score_frames_loop(level_info: Dict[str, Any], level_data: Dict[str, Any], power: float) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    スコア、コンボ、秒数、ランク、スコアバーのフレームリストを計算する。
+    ノートを1つずつ処理する参照実装で、ベクトル化版の検証に使用する。
+    """
     rating = level_info.get("rating", 1)
     entities = level_data.get("entities", [])
     
@@ -56,7 +64,7 @@ def _calculate_score_frames(level_info: Dict[str, Any], level_data: Dict[str, An
 
     weighted_notes_count = sum(WEIGHT_MAP.get(e.get("archetype", ""), 0.0) for e in entities)
     if weighted_notes_count == 0:
-        return [{"seconds": 0.0, "combo": 0, "score": 0, "add_score": 0, "rank": "d", "score_bar": 0.0}]
+        return [{"seconds": 0.0, "combo": 0, "score": 0, "add_score": 0, "rank": "d", "score_bar": 0.0}], 0.0
 
     bpm_changes: List[BpmChange] = []
     note_entities: List[Dict[str, Any]] = []
@@ -78,6 +86,7 @@ def _calculate_score_frames(level_info: Dict[str, Any], level_data: Dict[str, An
     level_fax = (rating - 5) * 0.005 + 1
     combo_fax = 1.0
     score = 0.0
+    last_note_time = 0.0
     
     for i, entity in enumerate(note_entities):
         combo_counter = i + 1
@@ -136,18 +145,372 @@ def _calculate_score_frames(level_info: Dict[str, Any], level_data: Dict[str, An
         
     return frames, last_note_time
 
-def generate_skobj_data(level_id: str, dist_dir: str, team_power: float, app_version: str) -> float:
+RANK_NAMES = ("none", "d", "c", "b", "a", "s")
+
+
+class ScoreTimeline:
+    """ノートごとのスコア推移を、ノート順に並んだ配列として保持する"""
+    def __init__(self, beats: np.ndarray, seconds: np.ndarray, combo: np.ndarray, combo_fax: np.ndarray,
+                 score: np.ndarray, add_score: np.ndarray, rank: np.ndarray, score_bar: np.ndarray):
+        self.beats = beats
+        self.seconds = seconds
+        self.combo = combo
+        self.combo_fax = combo_fax
+        self.score = score
+        self.add_score = add_score
+        self.rank = rank  # RANK_NAMES のインデックス
+        self.score_bar = score_bar
+
+    def __len__(self) -> int:
+        return len(self.combo)
+
+
+class TempoMap:
     """
-    譜面データを読み込み、スコアオブジェクトデータを計算してJSONファイルに出力する。
+    拍と秒数を相互に変換する区間線形マップ。
+    各区間の開始拍と1拍あたりの秒数から区間開始時点の累積秒数を一度だけ計算しておき、
+    以降の変換は二分探索で行う。
+    区間は「開始位置と倍率」で表されるため、#BPM_CHANGE だけでなく
+    #TIMESCALE_CHANGE のような区間の変換にも同じ形で使える。
+
+    最初の区間より前の位置は、区間が1つだけなら外挿し、複数ある場合は0秒とする
+    (従来の _get_time_from_bpm_changes と同じ挙動)。
     """
-    level_info_path = os.path.join(dist_dir, "level.json")
-    chart_path = os.path.join(dist_dir, "chart.json")
-    
+    def __init__(self, starts: List[float], rates: List[float]):
+        self.starts = np.array(starts, dtype=np.float64)
+        self.rates = np.array(rates, dtype=np.float64)
+
+        # 各区間の開始秒数 (先頭から順に区間の長さを足し込む)
+        durations = (self.starts[1:] - self.starts[:-1]) * self.rates[:-1]
+        self.start_seconds = np.concatenate(([0.0], np.cumsum(durations)))
+
+        # 単発の変換用に Python の float でも保持しておく
+        self._starts = self.starts.tolist()
+        self._rates = self.rates.tolist()
+        self._start_seconds = self.start_seconds.tolist()
+
+    @classmethod
+    def from_bpm_changes(cls, bpm_changes: List[BpmChange]) -> "TempoMap":
+        ordered = sorted(bpm_changes, key=lambda b: b.beat)
+        return cls([b.beat for b in ordered], [60 / b.bpm for b in ordered])
+
+    @classmethod
+    def from_beats_and_bpms(cls, beats: np.ndarray, bpms: np.ndarray) -> "TempoMap":
+        """エンティティ順に並んだ拍とBPMの配列から作成する (同じ拍は元の順序を保つ)"""
+        order = np.argsort(beats, kind="stable")
+        return cls(beats[order], 60 / bpms[order])
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def seconds_at(self, beat: float) -> float:
+        """拍を秒数に変換する"""
+        if not self._starts:
+            return 0.0
+        index = bisect.bisect_right(self._starts, beat) - 1
+        if index < 0:
+            if len(self._starts) > 1:
+                return 0.0
+            index = 0
+        return self._start_seconds[index] + (beat - self._starts[index]) * self._rates[index]
+
+    def seconds_at_many(self, beats: np.ndarray) -> np.ndarray:
+        """拍の配列を秒数の配列に一括で変換する"""
+        beats = np.asarray(beats, dtype=np.float64)
+        if not self._starts:
+            return np.zeros(len(beats))
+
+        index = np.searchsorted(self.starts, beats, side="right") - 1
+        before_first = index < 0
+        index[before_first] = 0
+        seconds = self.start_seconds[index] + (beats - self.starts[index]) * self.rates[index]
+        if len(self._starts) > 1:
+            seconds[before_first] = 0.0
+        return seconds
+
+    def beat_at(self, seconds: float) -> float:
+        """秒数を拍に変換する (倍率が正の区間のみを想定)"""
+        if not self._starts:
+            return 0.0
+        index = bisect.bisect_right(self._start_seconds, seconds) - 1
+        if index < 0:
+            if len(self._starts) > 1:
+                return self._starts[0]
+            index = 0
+        rate = self._rates[index]
+        if rate == 0:
+            return self._starts[index]
+        return self._starts[index] + (seconds - self._start_seconds[index]) / rate
+
+    def beats_at_many(self, seconds: np.ndarray) -> np.ndarray:
+        """秒数の配列を拍の配列に一括で変換する"""
+        seconds = np.asarray(seconds, dtype=np.float64)
+        if not self._starts:
+            return np.zeros(len(seconds))
+
+        index = np.searchsorted(self.start_seconds, seconds, side="right") - 1
+        before_first = index < 0
+        index[before_first] = 0
+        rates = self.rates[index]
+        safe_rates = np.where(rates == 0, 1.0, rates)
+        beats = np.where(rates == 0, self.starts[index],
+                         self.starts[index] + (seconds - self.start_seconds[index]) / safe_rates)
+        if len(self._starts) > 1:
+            beats[before_first] = self._starts[0]
+        return beats
+
+
+def _get_combo_fax_steps() -> np.ndarray:
+    """コンボ補正の段階値を、参照実装と同じ順序の加算で求める"""
+    steps = [1.0]
+    combo_fax = 1.0
+    while combo_fax != 1.1:
+        combo_fax += 0.01
+        if combo_fax > 1.1:
+            combo_fax = 1.1
+        steps.append(combo_fax)
+    return np.array(steps)
+
+
+def _compute_score_timeline(level_info: Dict[str, Any], chart: ChartColumns, power: float) -> Tuple[Optional[ScoreTimeline], float]:
+    """
+    全ノートのスコア推移を配列演算でまとめて計算する。
+    重み付きノート数が0の場合は (None, 0.0) を返す。
+    """
+    rating = level_info.get("rating", 1)
+
+    weighted_notes_count = chart.total_weight
+    if weighted_notes_count == 0:
+        return None, 0.0
+
+    tempo_map = TempoMap.from_beats_and_bpms(chart.beats[chart.is_bpm], chart.bpms[chart.is_bpm])
+
+    # 同じ拍のノートは元の順序を保つ (list.sort と同じ安定ソート)
+    note_beats = chart.beats[chart.is_note]
+    order = np.argsort(note_beats, kind="stable")
+    beats = note_beats[order]
+    weights = chart.weights[chart.is_note][order]
+    note_count = len(beats)
+
+    seconds = tempo_map.seconds_at_many(beats)
+    combo = np.arange(1, note_count + 1, dtype=np.int64)
+
+    # コンボ100ごとに補正が0.01ずつ増え、1.1で頭打ちになる
+    combo_fax_steps = _get_combo_fax_steps()
+    combo_fax = combo_fax_steps[np.minimum(np.arange(note_count) // 100, len(combo_fax_steps) - 1)]
+
+    level_fax = (rating - 5) * 0.005 + 1
+    add_score = (power / weighted_notes_count) * 4 * weights * 1 * level_fax * combo_fax * 1
+    score = np.cumsum(add_score)
+
+    # ランク境界 (参照実装と同じ値)
+    clamped_rating = max(5, min(rating, 40))
+    rank_border = 1200000 + (clamped_rating - 5) * 4100
+    rank_s = 1040000 + (clamped_rating - 5) * 5200
+    rank_a = 840000 + (clamped_rating - 5) * 4200
+    rank_b = 400000 + (clamped_rating - 5) * 2000
+    rank_c = 20000 + (clamped_rating - 5) * 100
+
+    POS_BORDER = 1.0
+    POS_S = 0.890
+    POS_A = 0.742
+    POS_B = 0.591
+    POS_C = 0.447
+
+    # 0: D未満, 1: C, 2: B, 3: A, 4: S, 5: ボーダー以上
+    band = np.searchsorted(np.array([rank_c, rank_b, rank_a, rank_s, rank_border], dtype=np.float64), score, side="right")
+    is_zero = (band == 0) & (score == 0)
+
+    rank = np.select(
+        [band >= 4, band == 3, band == 2, band == 1, is_zero],
+        [RANK_NAMES.index("s"), RANK_NAMES.index("a"), RANK_NAMES.index("b"), RANK_NAMES.index("c"), RANK_NAMES.index("none")],
+        default=RANK_NAMES.index("d"),
+    ).astype(np.int8)
+
+    score_bar_d = (score / rank_c) * POS_C if rank_c > 0 else np.zeros(note_count)
+    score_bar = np.select(
+        [band == 5, band == 4, band == 3, band == 2, band == 1, is_zero],
+        [
+            np.full(note_count, POS_BORDER),
+            ((score - rank_s) / (rank_border - rank_s)) * (POS_BORDER - POS_S) + POS_S,
+            ((score - rank_a) / (rank_s - rank_a)) * (POS_S - POS_A) + POS_A,
+            ((score - rank_b) / (rank_a - rank_b)) * (POS_A - POS_B) + POS_B,
+            ((score - rank_c) / (rank_b - rank_c)) * (POS_B - POS_C) + POS_C,
+            np.zeros(note_count),
+        ],
+        default=score_bar_d,
+    )
+
+    last_note_time = float(seconds[-1]) if note_count else 0.0
+    timeline = ScoreTimeline(beats, seconds, combo, combo_fax, score, add_score, rank, score_bar)
+    return timeline, last_note_time
+
+
+def _timeline_to_frames(timeline: ScoreTimeline) -> List[Dict[str, Any]]:
+    """配列形式のスコア推移を skobj_data.json 用のフレームリストに変換する"""
+    frames = [{"seconds": 0.0, "combo": 0, "score": 0, "add_score": 0, "rank": "none", "score_bar": 0.0}]
+    # round は Python の組み込み関数を使い、参照実装と同じ丸め結果にする
+    for seconds, combo, score, add_score, rank, score_bar in zip(
+        timeline.seconds.tolist(), timeline.combo.tolist(), timeline.score.tolist(),
+        timeline.add_score.tolist(), timeline.rank.tolist(), timeline.score_bar.tolist()
+    ):
+        frames.append({
+            "seconds": round(seconds, 6),
+            "combo": combo,
+            "score": round(score),
+            "add_score": round(add_score),
+            "rank": RANK_NAMES[rank],
+            "score_bar": round(score_bar, 6)
+        })
+    return frames
+
+
+def _calculate_score_frames(level_info: Dict[str, Any], chart: ChartColumns, power: float) -> Tuple[List[Dict[str, Any]], float]:
+    """スコア、コンボ、秒数、ランク、スコアバーのフレームリストを配列演算で計算する"""
+    timeline, last_note_time = _compute_score_timeline(level_info, chart, power)
+    if timeline is None:
+        return [{"seconds": 0.0, "combo": 0, "score": 0, "add_score": 0, "rank": "d", "score_bar": 0.0}], 0.0
+    return _timeline_to_frames(timeline), last_note_time
+
+# 出力形式ごとのファイル名
+#   json:    フレームごとの辞書のリスト (従来の形式)
+#   compact: 列ごとの配列を持つ JSON (同じ秒数のノートは1件にまとめる)
+#   lua:     compact と同じ内容を dofile で読み込める Lua のテーブルとして出力
+SKOBJ_FORMATS = {
+    "json": "skobj_data.json",
+    "compact": "skobj_data.json",
+    "lua": "skobj_data.lua",
+}
+
+# Lua の関数1つあたりの定数の数には上限があるため、配列はこの件数ごとに分けて出力する
+_LUA_ARRAY_CHUNK = 8192
+
+
+def get_skobj_filename(output_format: str) -> str:
+    if output_format not in SKOBJ_FORMATS:
+        raise ValueError(f"skobj data の出力形式 '{output_format}' はサポートされていません。")
+    return SKOBJ_FORMATS[output_format]
+
+def _build_frame_index(seconds: List[float], fps: float) -> Optional[Dict[str, Any]]:
+    """
+    各フレームデータが表示され始めるフレーム番号 (obj.frame - offset の整数値) の索引を作る。
+    @InitSettings の「seconds * framerate < frame - offset」と同じ条件を整数で表したもので、
+    AviUtl側ではこれを二分探索して現在のフレームデータを求める。
+    秒数が単調増加でない場合は索引を作らない (AviUtl側は従来の線形探索を行う)。
+    """
+    start_frames = np.floor(np.array(seconds, dtype=np.float64) * fps).astype(np.int64) + 1
+    if np.any(np.diff(start_frames) < 0):
+        return None
+    return {"fps": fps, "frames": start_frames.tolist()}
+
+def _frames_to_columns(score_frames: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """
+    フレームリストを列ごとの配列に変換する。
+    同じ秒数に並ぶフレームは、AviUtl側で実際に表示される最後の1件だけを残す。
+    """
+    columns: Dict[str, List[Any]] = {key: [] for key in ("seconds", "combo", "score", "add_score", "rank", "score_bar")}
+    for i, frame in enumerate(score_frames):
+        if i + 1 < len(score_frames) and score_frames[i + 1]["seconds"] == frame["seconds"]:
+            continue
+        columns["seconds"].append(frame["seconds"])
+        columns["combo"].append(frame["combo"])
+        columns["score"].append(frame["score"])
+        columns["add_score"].append(frame["add_score"])
+        columns["rank"].append(RANK_NAMES.index(frame["rank"]))
+        columns["score_bar"].append(frame["score_bar"])
+    return columns
+
+def _to_lua(value: Any) -> str:
+    """JSON と同じ構造の値を Lua のテーブル構築式に変換する"""
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{key} = {_to_lua(item)}" for key, item in value.items()) + "}"
+    if isinstance(value, list):
+        if len(value) <= _LUA_ARRAY_CHUNK:
+            return "{" + ", ".join(_to_lua(item) for item in value) + "}"
+        # 分割した配列をそれぞれ別の関数で作り、読み込み時に連結する
+        parts = ",\n".join(
+            "(function() return " + _to_lua(value[i:i + _LUA_ARRAY_CHUNK]) + " end)()"
+            for i in range(0, len(value), _LUA_ARRAY_CHUNK)
+        )
+        return "join({\n" + parts + "\n})"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if value is None:
+        return "nil"
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n").replace("\r", "\\r")
+    return f'"{escaped}"'
+
+def encode_skobj_data(score_frames: List[Dict[str, Any]], asset_path: str, app_version: str,
+                      output_format: str = "json", index_fps: float = SKOBJ_INDEX_FPS,
+                      asset_scale: float = 1.0) -> str:
+    """
+    スコアオブジェクトデータを指定した形式の文字列にする。
+    asset_scale は asset_path の画像の元の大きさに対する倍率 (1 以外のときだけ出力し、スクリプトが拡大率を補正する)。
+    """
+    get_skobj_filename(output_format)
+    scale_data = {"asset_scale": asset_scale} if asset_scale != 1 else {}
+
+    if output_format == "json":
+        output_data = {
+            "asset_path": asset_path,
+            **scale_data,
+            "version": app_version,
+            "objects": score_frames
+        }
+        frame_index = _build_frame_index([f["seconds"] for f in score_frames], index_fps)
+        if frame_index is not None:
+            output_data["frame_index"] = frame_index
+        return json.dumps(output_data, indent=4)
+
+    columns = _frames_to_columns(score_frames)
+    output_data = {
+        "asset_path": asset_path,
+        **scale_data,
+        "version": app_version,
+        "rank_names": list(RANK_NAMES),
+        "columns": columns
+    }
+    frame_index = _build_frame_index(columns["seconds"], index_fps)
+    if frame_index is not None:
+        output_data["frame_index"] = frame_index
+
+    if output_format == "compact":
+        return json.dumps(output_data, separators=(",", ":"))
+
+    return (
+        "-- skobj data (SekaiOverlay)\n"
+        "local function join(parts)\n"
+        "    local result = {}\n"
+        "    for _, part in ipairs(parts) do\n"
+        "        for i = 1, #part do\n"
+        "            result[#result + 1] = part[i]\n"
+        "        end\n"
+        "    end\n"
+        "    return result\n"
+        "end\n"
+        "return " + _to_lua(output_data) + "\n"
+    )
+
+def generate_skobj_data(context: LevelContext, team_power: float, app_version: str,
+                        index_fps: float = SKOBJ_INDEX_FPS, output_format: str = "json",
+                        assets_dir: Optional[str] = None, asset_scale: float = 1.0) -> float:
+    """
+    譜面データからスコアオブジェクトデータを計算してファイルに出力する。
+    譜面の情報と列は context から取る (context.chart が無い場合は chart.json を読む)。
+    index_fps のフレームレートで、フレーム番号からフレームデータを引くための索引も出力する。
+    出力形式とファイル名は SKOBJ_FORMATS を参照。
+    assets_dir と asset_scale には、ドラフト用に縮小したアセットのフォルダとその倍率を指定する。
+    """
+    output_filename = get_skobj_filename(output_format)
+    chart_path = os.path.join(context.dist_dir, "chart.json")
+    level_info = context.item
+    chart = context.chart
+
     try:
-        with open(level_info_path, 'r', encoding='utf-8') as f:
-            level_info = json.load(f)["item"]
-        with open(chart_path, 'r', encoding='utf-8') as f:
-            level_data = json.load(f)
+        if chart is None:
+            chart = load_chart_columns(chart_path)
     except FileNotFoundError as e:
         raise FileNotFoundError(f"必要なファイルが見つかりません: {e.filename}")
     except (json.JSONDecodeError, KeyError) as e:
@@ -155,18 +518,17 @@ def generate_skobj_data(level_id: str, dist_dir: str, team_power: float, app_ver
 
     print("スコアオブジェクトデータの生成を開始します...")
     
-    score_frames, last_note_time = _calculate_score_frames(level_info, level_data, team_power)
-    assets_full_path = os.path.abspath(resource_path('assets')).replace(os.sep, '\\')
-
-    output_data = {
-        "asset_path": assets_full_path + "\\",
-        "version": app_version,
-        "objects": score_frames
-    }
+    with tracing.span("score_frames", entities=len(chart)):
+        score_frames, last_note_time = _calculate_score_frames(level_info, chart, team_power)
+    assets_full_path = os.path.abspath(assets_dir or resource_path('assets')).replace(os.sep, '\\')
+    with tracing.span("skobj_encode", format=output_format):
+        content = encode_skobj_data(score_frames, assets_full_path + "\\", app_version, output_format, index_fps,
+                                    asset_scale)
 
-    output_path = os.path.join(dist_dir, "skobj_data.json")
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=4)
+    output_path = os.path.join(context.dist_dir, output_filename)
+    with tracing.span("skobj_write"), open(output_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+        tracing.add_bytes("written", f.tell())
         
     print(f"スコアオブジェクトデータを '{output_path}' に保存しました。")
-    return last_note_time
\ No newline at end of file
+    return last_note_time
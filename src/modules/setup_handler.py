@@ -1,6 +1,5 @@
 import os
 import sys
-import requests
 import configparser
 from tkinter import messagebox
 from src import config
@@ -109,6 +108,7 @@ def _install_obj_script():
 
 def _install_anm_script():
     """unmult.anm2, dkjson.luaをダウンロードしてインストールする"""
+    import requests
     dest_path = os.path.join(config.AVIUTL_SCRIPT_DIR, "unmult.anm2")
     response = requests.get(config.UNMULT_ANM_URL, timeout=15)
     response.raise_for_status()
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import threading
+from typing import Callable, Dict, Iterator, Optional
+import requests
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from src.modules.chart_columns import CHUNK_SIZE
+from src import tracing
+
+# 接続が切れたときに再試行する回数と、再試行までの待ち時間 (秒、回数ごとに倍にする)
+DOWNLOAD_RETRIES = 5
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 8.0
+
+DOWNLOAD_TIMEOUT = 15
+
+# 進捗を通知する最短の間隔 (秒)
+PROGRESS_INTERVAL = 0.25
+
+# 再試行する HTTP ステータス
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class TransferProgress:
+    """
+    並行して行う複数のダウンロードの進捗 (受信バイト数・速度・残り時間) をまとめて callback に通知する。
+    複数のスレッドから呼び出してよい。
+    """
+    def __init__(self, callback: Callable[[str], None], interval: float = PROGRESS_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self._totals: Dict[str, int] = {}
+        self._received: Dict[str, int] = {}
+        self._started = time.perf_counter()
+        self._last_report = 0.0
+        self._lock = threading.Lock()
+
+    def start(self, name: str, total: Optional[int]):
+        with self._lock:
+            self._totals[name] = total or 0
+            self._received.setdefault(name, 0)
+
+    def advance(self, name: str, nbytes: int):
+        with self._lock:
+            self._received[name] = self._received.get(name, 0) + nbytes
+            now = time.perf_counter()
+            if now - self._last_report < self.interval:
+                return
+            self._last_report = now
+            message = self._format(now)
+        self.callback(message)
+
+    def _format(self, now: float) -> str:
+        received = sum(self._received.values())
+        total = sum(self._totals.values())
+        rate = received / max(now - self._started, 1e-6)
+        text = f"データをダウンロード中... {received / 1e6:.1f}"
+        if total >= received and total > 0:
+            text += f" / {total / 1e6:.1f} MB"
+            if rate > 0:
+                text += f" ({rate / 1e6:.1f} MB/s, 残り約{(total - received) / rate:.0f}秒)"
+        else:
+            text += f" MB ({rate / 1e6:.1f} MB/s)"
+        return text
+
+
+class Download:
+    """
+    url の内容をチャンクごとに返しながら part_path に書き込む (part_path が None なら書き込まない)。
+    途中で接続が切れた場合は Range リクエストで続きから取得し直す (最大 retries 回、待ち時間は倍々に増やす)。
+    response に条件付きリクエストなどで取得済みのレスポンスを渡すと、その本文から読み始める。
+    resume が True なら、前の実行で中断して残った part_path の続きから取得する
+    (保存済みの部分も先頭から返すので、呼び出し側には常にファイル全体が渡る)。
+    """
+    def __init__(self, session: requests.Session, url: str, part_path: Optional[str] = None,
+                 progress: Optional[TransferProgress] = None, response: Optional[requests.Response] = None,
+                 retries: Optional[int] = None, resume: bool = False):
+        self.session = session
+        self.url = url
+        self.part_path = part_path
+        self.progress = progress
+        self.retries = DOWNLOAD_RETRIES if retries is None else retries
+        self.resume = resume and part_path is not None
+        self.headers: Dict[str, str] = {}
+        self.total: Optional[int] = None
+        self.received = 0
+        self._response = response
+        # 前の実行の part_path の続きを要求していて、まだ応答を確認していない
+        self._resuming = False
+
+    def _validator(self) -> Optional[str]:
+        return self.headers.get("ETag") or self.headers.get("Last-Modified")
+
+    def _load_resume_info(self):
+        """前の実行で残った part_path と再開用の情報があれば、その続きから取得するように準備する"""
+        try:
+            with open(resume_info_path(self.part_path), 'r', encoding='utf-8') as f:
+                info = json.load(f)
+            received = os.path.getsize(self.part_path)
+        except (OSError, ValueError):
+            return
+        headers = info.get("headers") or {}
+        total = info.get("total")
+        if info.get("url") != self.url or not (headers.get("ETag") or headers.get("Last-Modified")):
+            return
+        if not (isinstance(total, int) and 0 < received < total):
+            return
+        self.headers, self.total, self.received = headers, total, received
+        self._resuming = True
+        if self._response is not None:
+            # 渡されたレスポンスは先頭からなので使わない
+            self._response.close()
+            self._response = None
+
+    def _save_resume_info(self):
+        """中断しても次の実行で続きから取得できるように、ファイル全体の情報を残す"""
+        info = {"url": self.url, "headers": {k: v for k, v in self.headers.items() if k in ("ETag", "Last-Modified")},
+                "total": self.total}
+        try:
+            with open(resume_info_path(self.part_path), 'w', encoding='utf-8') as f:
+                json.dump(info, f)
+        except OSError:
+            pass
+
+    def _open(self) -> requests.Response:
+        """続きを取得するためのレスポンスを開く。最初の1回は通常の GET"""
+        if self._response is not None:
+            response, self._response = self._response, None
+            return response
+        headers = {}
+        if self.received:
+            headers["Range"] = f"bytes={self.received}-"
+            if self._validator():
+                headers["If-Range"] = self._validator()
+        return self.session.get(self.url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT)
+
+    def _start_body(self, response: requests.Response) -> int:
+        """レスポンスを確認し、本文の先頭で読み飛ばすバイト数を返す"""
+        if response.status_code in _RETRY_STATUS:
+            raise requests.exceptions.ConnectionError(f"HTTP {response.status_code}")
+        response.raise_for_status()
+
+        if self._resuming and response.status_code != 206:
+            # 前の実行の続きを取得できなかった (ファイルが変わったなど) ので、最初から取得し直す
+            print(f"  -> 中断したダウンロードを再開できないため、最初から取得します: {self.url}")
+            self.headers, self.total, self.received = {}, None, 0
+        self._resuming = False
+
+        if not self.headers:
+            # 最初のレスポンスのヘッダーをファイル全体の情報として使う
+            self.headers = dict(response.headers)
+            length = response.headers.get("Content-Length")
+            self.total = int(length) if length and length.isdigit() else None
+            if self.progress:
+                self.progress.start(self.url, self.total)
+            return 0
+
+        if response.status_code == 206:
+            return 0
+        # サーバーが Range に対応していない (200 が返った) 場合は、受信済みの部分を読み飛ばす
+        validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        if validator != self._validator():
+            raise RuntimeError(f"ダウンロード中にファイルが変更されました: {self.url}")
+        return self.received
+
+    def _replay_part(self) -> Iterator[bytes]:
+        """前の実行で part_path に保存済みの部分を返す"""
+        with open(self.part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                tracing.add_bytes("read", len(chunk))
+                yield chunk
+        if self.progress:
+            self.progress.start(self.url, self.total)
+            self.progress.advance(self.url, self.received)
+        print(f"  -> 中断したダウンロードを {self.received} バイト目から再開します: {self.url}")
+
+    def __iter__(self) -> Iterator[bytes]:
+        attempt = 0
+        part_file = None
+        if self.resume:
+            self._load_resume_info()
+        try:
+            while True:
+                try:
+                    with self._open() as response:
+                        skip = self._start_body(response)
+                        if self.part_path and part_file is None:
+                            # 最初に本文を受け取ったときに開く (前の実行の続きなら保存済みの部分を返してから追記する)
+                            if self.received:
+                                yield from self._replay_part()
+                                part_file = open(self.part_path, 'ab')
+                            else:
+                                part_file = open(self.part_path, 'wb')
+                                if self.resume:
+                                    self._save_resume_info()
+                        for chunk in response.raw.stream(CHUNK_SIZE, decode_content=False):
+                            if skip:
+                                if len(chunk) <= skip:
+                                    skip -= len(chunk)
+                                    continue
+                                chunk, skip = chunk[skip:], 0
+                            if part_file:
+                                part_file.write(chunk)
+                            self.received += len(chunk)
+                            tracing.add_bytes("downloaded", len(chunk))
+                            if self.progress:
+                                self.progress.advance(self.url, len(chunk))
+                            yield chunk
+                    if self.total is not None and self.received < self.total:
+                        raise requests.exceptions.ConnectionError(
+                            f"接続が途中で切れました ({self.received} / {self.total} バイト)")
+                    break
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError, Urllib3HTTPError) as e:
+                    if attempt >= self.retries:
+                        raise RuntimeError(f"ダウンロードに失敗しました: {self.url} ({e})")
+                    wait = min(RETRY_BACKOFF * 2 ** attempt, RETRY_BACKOFF_MAX)
+                    attempt += 1
+                    print(f"  -> ダウンロードが中断されました。{wait:.1f}秒後に再開します ({attempt}/{self.retries}): {e}")
+                    time.sleep(wait)
+        finally:
+            if part_file:
+                part_file.close()
+        if self.resume:
+            _remove_quietly(resume_info_path(self.part_path))
+
+
+def resume_info_path(part_path: str) -> str:
+    """途中まで保存したファイルの再開用の情報 (ETag などとファイル全体のサイズ) のパス"""
+    return part_path + ".json"
+
+
+def move_partial(src_path: str, dest_path: str) -> bool:
+    """途中まで保存したファイルを再開用の情報ごと移す。src_path が無い (他のプロセスが先に移したなど) なら False"""
+    try:
+        os.replace(src_path, dest_path)
+    except OSError:
+        return False
+    try:
+        os.replace(resume_info_path(src_path), resume_info_path(dest_path))
+    except OSError:
+        _remove_quietly(resume_info_path(dest_path))
+    return True
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def download_file(session: requests.Session, url: str, dest_path: str,
+                  progress: Optional[TransferProgress] = None) -> Dict[str, str]:
+    """
+    url を dest_path.part にダウンロードし、完了したら dest_path に置き換える。
+    失敗しても dest_path.part は残し、次に呼ばれたときにその続きから取得する。
+    最初のレスポンスのヘッダーを返す。
+    """
+    part_path = dest_path + ".part"
+    download = Download(session, url, part_path, progress, resume=True)
+    for _ in download:
+        pass
+    os.replace(part_path, dest_path)
+    return download.headers
@@ -0,0 +1,242 @@
+import os
+import json
+import hashlib
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from src import tracing
+
+# 同時に実行するステージの数 (ダウンロード3本 + 描画・計算が重なる程度)
+PIPELINE_WORKERS = 4
+
+MANIFEST_VERSION = 1
+
+# ドライランで実行しなかったステージの成果物
+_NOT_BUILT = object()
+
+
+def fingerprint(value: Any) -> str:
+    """
+    成果物の指紋 (SHA-256) を作る。
+    fingerprint() を持つオブジェクトはその結果を、画像や配列 (tobytes() を持つもの) はその内容を、
+    存在するファイルのパスはファイルの内容を、それ以外は JSON にした値を使う。
+    """
+    if hasattr(value, "fingerprint"):
+        return value.fingerprint()
+    digest = hashlib.sha256()
+    if hasattr(value, "tobytes"):
+        digest.update(repr((type(value).__name__, getattr(value, "mode", None), getattr(value, "size", None),
+                            getattr(value, "shape", None))).encode())
+        digest.update(value.tobytes())
+        return "bytes:" + digest.hexdigest()
+    if isinstance(value, str) and os.path.isfile(value):
+        with open(value, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return "file:" + digest.hexdigest()
+    digest.update(json.dumps(value, sort_keys=True, ensure_ascii=False, default=repr).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class Stage:
+    """
+    パイプラインの1工程。inputs の成果物がすべて揃ったら func(*inputs) を実行し、
+    戻り値を outputs の名前で成果物として登録する (outputs が2つ以上ならタプルを順に割り当てる)。
+
+    params を指定したステージはマニフェストに記録され、params と inputs の指紋が前回と同じで
+    files がすべて残っていれば実行を省略する (成果物は save で保存した値を load で戻す)。
+    params が None のステージは毎回実行する。
+    """
+    def __init__(self, name: str, func: Callable[..., Any], inputs: Sequence[str] = (), outputs: Sequence[str] = (),
+                 params: Any = None, files: Sequence[str] = (),
+                 save: Optional[Callable[[Any], Any]] = None, load: Optional[Callable[[Any], Any]] = None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.params = params
+        self.files = tuple(files)
+        self.save = save or (lambda value: value)
+        self.load = load or (lambda value: value)
+
+    @property
+    def tracked(self) -> bool:
+        return self.params is not None
+
+    def run(self, artifacts: Dict[str, Any]) -> Dict[str, Any]:
+        result = self.func(*[artifacts[name] for name in self.inputs])
+        if not self.outputs:
+            return {}
+        if len(self.outputs) == 1:
+            return {self.outputs[0]: result}
+        return dict(zip(self.outputs, result))
+
+    def key(self, input_fingerprints: List[str]) -> str:
+        """params と inputs の指紋から、このステージの入力を表すキーを作る"""
+        data = [self.name, self.params, list(self.inputs), input_fingerprints]
+        return hashlib.sha256(json.dumps(data, sort_keys=True, ensure_ascii=False, default=repr).encode('utf-8')).hexdigest()
+
+
+class Manifest:
+    """
+    出力フォルダの manifest.json。ステージごとに、入力のキー・成果物・出力したファイルのサイズを記録する。
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.root = os.path.dirname(path)
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.stages = data.get("stages", {})
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def is_fresh(self, stage: Stage, key: str) -> bool:
+        entry = self.stages.get(stage.name)
+        if not entry or entry.get("key") != key or set(entry.get("outputs", {})) != set(stage.outputs):
+            return False
+        for relpath, size in entry.get("files", {}).items():
+            path = os.path.join(self.root, relpath)
+            if not os.path.isfile(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+    def record(self, stage: Stage, key: str, outputs: Dict[str, Any], fingerprints: Dict[str, str]):
+        self.stages[stage.name] = {
+            "key": key,
+            "outputs": {name: stage.save(value) for name, value in outputs.items()},
+            "fingerprints": {name: fingerprints[name] for name in outputs},
+            "files": {os.path.relpath(path, self.root): os.path.getsize(path) for path in stage.files},
+        }
+
+    def restore(self, stage: Stage) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        entry = self.stages[stage.name]
+        outputs = {name: stage.load(value) for name, value in entry["outputs"].items()}
+        return outputs, dict(entry.get("fingerprints", {}))
+
+    def discard(self, name: str):
+        self.stages.pop(name, None)
+
+    def save(self):
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": MANIFEST_VERSION, "stages": self.stages}, f, indent=2, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"マニフェストを保存できませんでした: {e}")
+
+
+class Pipeline:
+    """
+    Stage の依存関係 (inputs / outputs) に従って、実行可能になったステージから順にスレッドで並行実行する。
+    どれかのステージが失敗したら新しいステージは始めず、実行中のものを待ってから最初の例外を送出する。
+    manifest を渡すと、入力が前回から変わっていないステージは実行せずに前回の成果物を使う。
+    """
+    def __init__(self, stages: List[Stage], max_workers: int = PIPELINE_WORKERS):
+        self.stages = stages
+        self.max_workers = max_workers
+        # ステージごとの扱い ("実行" / "省略" / ドライランでの "再生成")
+        self.plan: Dict[str, str] = {}
+        self._check(stages)
+
+    @staticmethod
+    def _check(stages: List[Stage]):
+        """同じ成果物を出力するステージが複数ないかを確認する"""
+        produced = set()
+        for stage in stages:
+            for name in stage.outputs:
+                if name in produced:
+                    raise ValueError(f"成果物 '{name}' を出力するステージが複数あります。")
+                produced.add(name)
+
+    def run(self, artifacts: Optional[Dict[str, Any]] = None, manifest: Optional[Manifest] = None,
+            force: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+        """
+        全ステージを実行し、成果物の辞書を返す (artifacts には最初から揃っている成果物を渡せる)。
+        force が True なら manifest があっても全ステージを実行する。
+        dry_run が True なら記録されたステージは実行せず、plan に再生成が必要かどうかだけを残す。
+        """
+        artifacts = dict(artifacts or {})
+        fingerprints: Dict[str, Optional[str]] = {}
+        pending = list(self.stages)
+        running: Dict[Future, Tuple[Stage, Optional[str]]] = {}
+        error: Optional[BaseException] = None
+
+        def traced(stage: Stage, inputs: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+            with tracing.span(stage.name, "stage"):
+                outputs = stage.run(inputs)
+                return outputs, {name: fingerprint(value) for name, value in outputs.items()}
+
+        def input_fingerprint(name: str) -> Optional[str]:
+            if name not in fingerprints:
+                fingerprints[name] = fingerprint(artifacts[name])
+            return fingerprints[name]
+
+        def not_built(stage: Stage):
+            for name in stage.outputs:
+                artifacts[name] = _NOT_BUILT
+                fingerprints[name] = None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                # 省略したステージの成果物で次のステージが実行可能になることがあるので、揃わなくなるまで繰り返す
+                while error is None:
+                    ready = [s for s in pending if all(name in artifacts for name in s.inputs)]
+                    if not ready:
+                        break
+                    for stage in ready:
+                        pending.remove(stage)
+                        inputs = {name: artifacts[name] for name in stage.inputs}
+                        key = None
+                        if manifest is not None and stage.tracked:
+                            input_fingerprints = [input_fingerprint(name) for name in stage.inputs]
+                            if None not in input_fingerprints:
+                                key = stage.key(input_fingerprints)
+                            if key is not None and not force and manifest.is_fresh(stage, key):
+                                outputs, saved_fingerprints = manifest.restore(stage)
+                                artifacts.update(outputs)
+                                fingerprints.update(saved_fingerprints)
+                                self.plan[stage.name] = "省略"
+                                continue
+                            if dry_run:
+                                not_built(stage)
+                                self.plan[stage.name] = "再生成"
+                                continue
+                        elif dry_run and _NOT_BUILT in inputs.values():
+                            not_built(stage)
+                            continue
+                        self.plan[stage.name] = "実行"
+                        running[executor.submit(traced, stage, inputs)] = (stage, key)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, key = running.pop(future)
+                    try:
+                        outputs, output_fingerprints = future.result()
+                    except BaseException as e:
+                        if manifest is not None:
+                            manifest.discard(stage.name)
+                        if error is None:
+                            error = e
+                        continue
+                    artifacts.update(outputs)
+                    fingerprints.update(output_fingerprints)
+                    if manifest is not None and key is not None:
+                        manifest.record(stage, key, outputs, output_fingerprints)
+
+        if manifest is not None and not dry_run:
+            manifest.save()
+        if error is not None:
+            raise error
+        if pending:
+            missing = sorted({name for stage in pending for name in stage.inputs if name not in artifacts})
+            raise ValueError(f"依存する成果物が揃わないステージがあります: "
+                             f"{', '.join(stage.name for stage in pending)} (不足: {', '.join(missing)})")
+        return artifacts
+
+    def plan_text(self) -> str:
+        return " / ".join(f"{name}: {action}" for name, action in self.plan.items())
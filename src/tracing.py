@@ -0,0 +1,262 @@
+"""
+生成処理の計測 (トレース)。
+
+Generator が Tracer を activate している間、各モジュールの span() が区間ごとに
+経過時間・CPU 時間・開始時と終了時の RSS・読み書き/ダウンロードしたバイト数を記録する。
+記録は Chrome のトレース形式 (chrome://tracing や Perfetto で開ける JSON) と1行の要約で出力できる。
+Tracer を activate していないときの span() / add_bytes() は何もしない。
+"""
+import os
+import sys
+import json
+import time
+import threading
+import contextlib
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+# add_bytes() に渡すバイト数の種類
+BYTE_KINDS = ("read", "written", "downloaded")
+
+# 実行中の Tracer (1つのプロセスで同時に動く Generator は1つだけ)
+_active: Optional["Tracer"] = None
+
+# cProfile は Python 3.12 以降、1つのプロセスで同時に1つしか有効にできないため、計測するステージは1つずつ実行する
+_profile_lock = threading.RLock()
+
+
+def _windows_memory_counters():
+    """Windows の PROCESS_MEMORY_COUNTERS を返す。取得できなければ None"""
+    import ctypes
+    from ctypes import wintypes
+
+    class _MemoryCounters(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    counters = _MemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    try:
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+            return counters
+    except (AttributeError, OSError):
+        pass
+    return None
+
+
+def _current_rss() -> Optional[int]:
+    """プロセスの現在の常駐メモリ (バイト) を返す。取得できない環境 (macOS など) では None"""
+    if sys.platform == "win32":
+        counters = _windows_memory_counters()
+        return counters.WorkingSetSize if counters is not None else None
+    try:
+        # 2番目の値が常駐しているページ数
+        with open("/proc/self/statm", "rb") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _process_peak_rss() -> Optional[int]:
+    """
+    プロセスが起動してからの最大常駐メモリ (バイト) を返す。取得できない環境では None。
+    一括生成では前の譜面の分も含むので、区間ごとの値としては使わない。
+    """
+    if sys.platform == "win32":
+        counters = _windows_memory_counters()
+        return counters.PeakWorkingSetSize if counters is not None else None
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト、Linux は KiB 単位
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Span:
+    """計測した1区間。時間は Tracer の開始からの秒数"""
+    def __init__(self, name: str, category: str, args: Dict[str, Any]):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.start = 0.0
+        self.wall = 0.0
+        self.cpu = 0.0
+        # 区間の開始時と終了時のプロセス全体の RSS (並行するステージの分も含む)
+        self.rss_start: Optional[int] = None
+        self.rss_end: Optional[int] = None
+        self.bytes = {kind: 0 for kind in BYTE_KINDS}
+
+
+class Tracer:
+    """
+    span の記録を集める。複数のスレッドから使ってよい。
+    profile に含まれる名前 ("all" なら全て) のステージは cProfile で計測し、profile_dir に <名前>.prof を保存する。
+    cProfile で計測するステージは並行に実行せず1つずつ実行する (Python 3.12 以降は他のスレッドの処理も含まれる)。
+    """
+    def __init__(self, profile: Iterable[str] = (), profile_dir: Optional[str] = None):
+        self.spans: List[Span] = []
+        self.profile = set(profile)
+        self.profile_dir = profile_dir
+        self.profile_paths: List[str] = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self) -> List[Span]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str = "step", **args: Any) -> Iterator[Span]:
+        span = Span(name, category, args)
+        stack = self._stack()
+        stack.append(span)
+        profiler = None
+        span.rss_start = _current_rss()
+        try:
+            if category == "stage":
+                profiler = self._start_profile(name)
+            cpu_start = time.thread_time()
+            start = time.perf_counter()
+            try:
+                yield span
+            finally:
+                end = time.perf_counter()
+                span.cpu = time.thread_time() - cpu_start
+                span.start = start - self._origin
+                span.wall = end - start
+        finally:
+            if profiler is not None:
+                self._finish_profile(name, profiler)
+            span.rss_end = _current_rss()
+            stack.pop()
+            with self._lock:
+                self.spans.append(span)
+
+    def add_bytes(self, kind: str, nbytes: int):
+        """現在のスレッドで開いている全ての span に、読み書きしたバイト数を加える"""
+        for span in self._stack():
+            span.bytes[kind] += nbytes
+
+    def _start_profile(self, name: str):
+        if not self.profile_dir or not (name in self.profile or "all" in self.profile):
+            return None
+        import cProfile
+        # 他のステージの計測が終わるまで待つ (_finish_profile で解放する)
+        _profile_lock.acquire()
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            # 他のツール (python -m cProfile など) が計測中
+            _profile_lock.release()
+            print(f"ステージ '{name}' は cProfile で計測できませんでした: {e}")
+            return None
+        return profiler
+
+    def _finish_profile(self, name: str, profiler):
+        try:
+            profiler.disable()
+        finally:
+            _profile_lock.release()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, f"{name}.prof")
+        profiler.dump_stats(path)
+        with self._lock:
+            self.profile_paths.append(path)
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """Chrome のトレースイベント形式 (完了イベント "X") の辞書を返す"""
+        pid = os.getpid()
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        events: List[Dict[str, Any]] = []
+        for thread_id, thread_name in {s.thread_id: s.thread_name for s in spans}.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id,
+                           "args": {"name": thread_name}})
+        for span in spans:
+            args = dict(span.args)
+            args["cpu_ms"] = round(span.cpu * 1000, 3)
+            if span.rss_end is not None:
+                args["rss_mb"] = round(span.rss_end / 1e6, 1)
+                if span.rss_start is not None:
+                    args["rss_delta_mb"] = round((span.rss_end - span.rss_start) / 1e6, 1)
+            args.update({f"bytes_{kind}": n for kind, n in span.bytes.items() if n})
+            events.append({
+                "name": span.name, "cat": span.category, "ph": "X", "pid": pid, "tid": span.thread_id,
+                "ts": round(span.start * 1e6, 1), "dur": round(span.wall * 1e6, 1),
+                "args": {key: value if isinstance(value, (int, float, str, bool)) else str(value)
+                         for key, value in args.items()},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def summary(self) -> str:
+        """
+        ステージごとの経過時間と、全体の時間・CPU 時間・RSS・バイト数を1行にまとめる。
+        RSS は区間の開始時と終了時に測った値の最大で、プロセスの最大 RSS (前の譜面の分も含む) は括弧内に示す
+        """
+        with self._lock:
+            spans = list(self.spans)
+        stages = sorted((s for s in spans if s.category == "stage"), key=lambda s: s.start)
+        if not spans:
+            return "計測した区間はありません"
+        start = min(s.start for s in spans)
+        end = max(s.start + s.wall for s in spans)
+        parts = [f"{s.name} {s.wall:.2f}秒" for s in stages]
+        totals = [f"全体 {end - start:.2f}秒", f"CPU {sum(s.cpu for s in stages):.2f}秒"]
+        samples = [rss for s in spans for rss in (s.rss_start, s.rss_end) if rss is not None]
+        process_peak = _process_peak_rss()
+        if samples:
+            rss = f"RSS {max(samples) / 1e6:.0f}MB"
+            if process_peak is not None:
+                # 取得元が違うので、わずかに下回ることがある
+                rss += f" (プロセスの最大 {max(process_peak, max(samples)) / 1e6:.0f}MB)"
+            totals.append(rss)
+        elif process_peak is not None:
+            totals.append(f"プロセスの最大RSS {process_peak / 1e6:.0f}MB")
+        labels = {"read": "読込", "written": "書込", "downloaded": "受信"}
+        for kind in BYTE_KINDS:
+            nbytes = sum(s.bytes[kind] for s in stages)
+            if nbytes:
+                totals.append(f"{labels[kind]} {nbytes / 1e6:.1f}MB")
+        return " / ".join(parts + totals)
+
+
+@contextlib.contextmanager
+def activate(tracer: Tracer) -> Iterator[Tracer]:
+    """with の間、span() / add_bytes() の記録先を tracer にする"""
+    global _active
+    previous, _active = _active, tracer
+    try:
+        yield tracer
+    finally:
+        _active = previous
+
+
+def span(name: str, category: str = "step", **args: Any):
+    """現在の Tracer に区間を記録する context manager を返す (Tracer が無ければ何もしない)"""
+    tracer = _active
+    if tracer is None:
+        return contextlib.nullcontext()
+    return tracer.span(name, category, **args)
+
+
+def add_bytes(kind: str, nbytes: int):
+    tracer = _active
+    if tracer is not None:
+        tracer.add_bytes(kind, nbytes)
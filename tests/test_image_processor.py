@@ -0,0 +1,16 @@
+"""合成エンジン (_render_fused) の結果が、PIL 版との差 FUSED_TOLERANCE 以内に収まることを確かめる"""
+import numpy as np
+import pytest
+
+from benchmarks import synthetic
+from src.modules import image_processor
+
+
+@pytest.mark.parametrize("size", synthetic.JACKET_SIZES)
+@pytest.mark.parametrize("version", ["3", "1"])
+def test_fused_within_tolerance(version, size):
+    jacket = synthetic.make_jacket(size, seed=size).convert("RGBA")
+    expected = np.asarray(image_processor._RENDERERS[version](jacket), dtype=np.int16)
+    actual = np.asarray(image_processor._render_fused(jacket, version), dtype=np.int16)
+    assert actual.shape == expected.shape
+    assert np.abs(actual - expected).max() <= image_processor.FUSED_TOLERANCE
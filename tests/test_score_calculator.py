@@ -0,0 +1,44 @@
+"""ベクトル化したスコア計算が、ノートを1つずつ処理する参照実装と同じ結果になることを確かめる"""
+import pytest
+
+from benchmarks import synthetic
+from src.modules.chart_columns import build_chart_columns
+from src.modules.score_calculator import _calculate_score_frames, _calculate_score_frames_loop
+
+# (ノーツ数, BPM 変化数, 乱数の種)
+CHARTS = [
+    (1, 1, 0),
+    (150, 1, 1),
+    (1000, 1, 2),
+    (1000, 40, 3),
+    (3000, 200, 4),
+]
+
+# 5 未満と 40 より大きいレーティングはランクの境界の計算で丸められる
+RATINGS = [1, 5, 26, 33, 40, 45]
+
+POWERS = [250000.0, 3000000.0]
+
+
+def _compare(chart, rating, power):
+    level_info = synthetic.make_level_item(rating=rating)
+    expected = _calculate_score_frames_loop(level_info, chart, power)
+    actual = _calculate_score_frames(level_info, build_chart_columns(chart["entities"]), power)
+    assert actual == expected
+
+
+@pytest.mark.parametrize("power", POWERS)
+@pytest.mark.parametrize("rating", RATINGS)
+@pytest.mark.parametrize("note_count,bpm_changes,seed", CHARTS)
+def test_matches_loop(note_count, bpm_changes, seed, rating, power):
+    _compare(synthetic.make_chart(note_count, bpm_changes, seed=seed), rating, power)
+
+
+def test_matches_loop_without_weighted_notes():
+    chart = synthetic.make_chart(200, 3, archetype_mix={"NormalSlideConnector": 1, "HiddenSlideTickNote": 1})
+    _compare(chart, 30, 250000.0)
+
+
+def test_matches_loop_with_only_heavy_notes():
+    chart = synthetic.make_chart(500, 5, archetype_mix={"CriticalFlickNote": 1, "CriticalTraceFlickNote": 1}, seed=7)
+    _compare(chart, 30, 250000.0)
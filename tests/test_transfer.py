@@ -0,0 +1,99 @@
+"""途中で切断されたダウンロードを、次の実行で続きから取得できることをスタブサーバーで確かめる"""
+import hashlib
+import json
+import os
+
+import pytest
+import requests
+
+from benchmarks.stub_server import REPOSITORY_PATH, StubServer
+from src.modules import transfer
+from src.modules.http_cache import HttpCache
+
+LEVEL_ID = "stub-resume"
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    # 1回目の切断で諦めさせ、プロセスを終えたのと同じ状態 (.part だけが残る) にする
+    monkeypatch.setattr(transfer, "DOWNLOAD_RETRIES", 0)
+    with StubServer(bgm_bytes=400_000, seed=1) as server:
+        yield server
+
+
+def _url(stub: StubServer, name: str) -> str:
+    return f"{stub.base_url}{REPOSITORY_PATH}{LEVEL_ID}/{name}"
+
+
+def _fail_until_partial(stub: StubServer, download, part_path: str) -> int:
+    """切断されて part_path が残るまで失敗させ、残ったバイト数を返す (失敗の半分は 503 で何も残らない)"""
+    stub.failure_rate = 1.0
+    for _ in range(20):
+        with pytest.raises(RuntimeError):
+            download()
+        if os.path.exists(part_path) and os.path.getsize(part_path) > 0:
+            break
+    stub.failure_rate = 0.0
+    size = os.path.getsize(part_path)
+    assert 0 < size < len(stub.file(LEVEL_ID, "bgm.mp3"))
+    return size
+
+
+def test_download_file_resumes_from_part(stub, tmp_path):
+    body = stub.file(LEVEL_ID, "bgm.mp3")
+    dest_path = str(tmp_path / "music.mp3")
+    with requests.Session() as session:
+        download = lambda: transfer.download_file(session, _url(stub, "bgm.mp3"), dest_path)
+        received = _fail_until_partial(stub, download, dest_path + ".part")
+
+        sent_before = stub.stats["bytes"]
+        download()
+
+    with open(dest_path, "rb") as f:
+        assert f.read() == body
+    assert stub.stats["bytes"] - sent_before == len(body) - received
+    assert not os.path.exists(dest_path + ".part")
+    assert not os.path.exists(transfer.resume_info_path(dest_path + ".part"))
+
+
+def test_download_file_restarts_when_file_changed(stub, tmp_path):
+    body = stub.file(LEVEL_ID, "bgm.mp3")
+    dest_path = str(tmp_path / "music.mp3")
+    part_path = dest_path + ".part"
+    with requests.Session() as session:
+        download = lambda: transfer.download_file(session, _url(stub, "bgm.mp3"), dest_path)
+        _fail_until_partial(stub, download, part_path)
+
+        # 保存済みの部分とサーバーの内容が違う扱いにする (If-Range が一致しないので 200 が返る)
+        info_path = transfer.resume_info_path(part_path)
+        with open(info_path, "r", encoding="utf-8") as f:
+            info = json.load(f)
+        info["headers"]["ETag"] = '"changed"'
+        with open(info_path, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+
+        sent_before = stub.stats["bytes"]
+        download()
+
+    with open(dest_path, "rb") as f:
+        assert f.read() == body
+    assert stub.stats["bytes"] - sent_before == len(body)
+
+
+def test_http_cache_resumes_from_partial(stub, tmp_path):
+    body = stub.file(LEVEL_ID, "bgm.mp3")
+    url = _url(stub, "bgm.mp3")
+    cache = HttpCache(str(tmp_path / "http"), 10 * 1024 * 1024)
+    dest_path = str(tmp_path / "music.mp3")
+    with requests.Session() as session:
+        download = lambda: cache.fetch(url, dest_path, session)
+        received = _fail_until_partial(stub, download, cache._partial_path(url))
+
+        sent_before = stub.stats["bytes"]
+        download()
+
+    with open(dest_path, "rb") as f:
+        assert f.read() == body
+    assert stub.stats["bytes"] - sent_before == len(body) - received
+    assert os.path.exists(cache.blobs.path_for(hashlib.sha256(body).hexdigest()))
+    assert os.listdir(cache.partial_dir) == []